@@ -1,47 +1,126 @@
-import argparse
-from wsgiref.simple_server import make_server
+from aliyun_exporter.startup import start_time
 
-import yaml
+import argparse
 import logging
+import os
 import signal
 import sys
 import time
 
-from prometheus_client.core import REGISTRY
+from prometheus_client import Gauge
+from prometheus_client.core import REGISTRY, CollectorRegistry
 
-from aliyun_exporter.collector import AliyunCollector, CollectorConfig
+from aliyun_exporter.coalesce import CoalescingCollector
+# CollectorConfig is re-exported for the web app
+from aliyun_exporter.collector import AliyunCollector, CollectorConfig, SharedResources  # noqa: F401
+from aliyun_exporter.polling import PollingCollector
+from aliyun_exporter.reload import ConfigReloader, load_config
+from aliyun_exporter.server import make_server
+from aliyun_exporter.state import StateStore
 from aliyun_exporter.web import create_app
 
+importDurationGauge = Gauge('aliyun_exporter_import_duration_seconds', 'Time spent importing the exporter package')
+startupDurationGauge = Gauge('aliyun_exporter_startup_duration_seconds',
+                             'Time from importing the exporter until it listened for scrapes')
+importDurationGauge.set(time.time() - start_time)
+
 
 def shutdown():
     logging.info('Shutting down, see you next time!')
     sys.exit(1)
 
-def signal_handler():
+def signal_handler(signum, frame):
     shutdown()
 
+def parse_module(spec: str):
+    if '=' in spec:
+        return spec.split('=', 1)
+    return os.path.splitext(os.path.basename(spec))[0], spec
+
+'''
+Module names and paths of the config files. Modules are served at
+/metrics?module=<name>, so two config files with the same name, like
+conf/redis.yml and backup/redis.yml, must be named apart as module=path.
+'''
+def parse_modules(specs):
+    modules = []
+    for spec in specs:
+        module, path = parse_module(spec)
+        if module in [name for name, _ in modules]:
+            raise Exception('Duplicate module name {}, name the config files as module=path.'.format(module))
+        modules.append((module, path))
+    return modules
+
+'''
+Load the config files as modules sharing 'shared', each tracked by
+'reloader'. The state file is known before any module is built, so the
+inventory, period cache and snapshot of every module are restored and
+saved.
+'''
+def load_modules(config_files, shared: SharedResources, reloader: ConfigReloader):
+    registries = dict()
+    configs = []
+    state = None
+    modules = [(module, path, load_config(path)) for module, path in parse_modules(config_files)]
+    # One state file for every module, taken from the first config setting it
+    state_configs = [config for _, _, config in modules if config.state_file]
+    if state_configs:
+        state = StateStore(state_configs[0].state_file, state_configs[0].state_interval)
+        reloader.state = state
+    for module, path, collector_config in modules:
+        configs.append(collector_config)
+        collector = AliyunCollector(collector_config, shared)
+        if state is not None:
+            # Restore before anything is fetched, so the first scrape is warm
+            for (access_key_id, _, region), provider in list(shared.info_providers.items()):
+                state.track('inventory/{}/{}'.format(access_key_id, region), provider)
+            if collector.period_cache is not None:
+                state.track('period/' + module, collector.period_cache)
+        if collector_config.polling_interval:
+            wrapper = PollingCollector(collector, collector_config.polling_interval)
+            if state is not None:
+                state.track('snapshot/' + module, wrapper)
+            wrapper.start()
+        else:
+            wrapper = CoalescingCollector(collector, collector_config.coalesce_window)
+        # A single config keeps being served at /metrics, several configs
+        # are only served at /metrics?module=<name>.
+        registry = REGISTRY if len(config_files) == 1 else CollectorRegistry(auto_describe=False)
+        registry.register(wrapper)
+        registries[module] = registry
+        reloader.track(module, path, collector_config, collector, wrapper, registry)
+        logging.info("Loaded module {} from {}".format(module, path))
+    return configs, registries, state
+
 def main():
     signal.signal(signal.SIGTERM, signal_handler)
     logging.getLogger().setLevel(logging.INFO)
 
     parser = argparse.ArgumentParser(description="Aliyun CloudMonitor exporter for Prometheus.")
-    parser.add_argument('-c', '--config-file', default='aliyun-exporter.yml',
-                       help='path to configuration file.')
+    parser.add_argument('-c', '--config-file', action='append',
+                        help='path to configuration file, repeat as [module=]path to serve several modules.')
     parser.add_argument('-p', '--port', default=9525,
                         help='exporter exposed port')
+    parser.add_argument('--watch-interval', type=float, default=None,
+                        help='seconds between checks of the configuration files for changes, '
+                             'by default they are only reloaded on SIGHUP.')
     args = parser.parse_args()
 
-    with open(args.config_file, 'r') as config_file:
-        cfg = yaml.load(config_file, Loader=yaml.FullLoader)
-    collector_config = CollectorConfig(**cfg)
+    config_files = args.config_file or ['aliyun-exporter.yml']
+    shared = SharedResources()
+    reloader = ConfigReloader(shared, watch_interval=args.watch_interval)
+    configs, registries, state = load_modules(config_files, shared, reloader)
 
-    collector = AliyunCollector(collector_config)
-    REGISTRY.register(collector)
+    if state is not None:
+        state.start()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request_reload())
+    reloader.start()
 
-    app = create_app(collector_config)
+    app = create_app(configs[0], registries, shared)
 
     logging.info("Start exporter, listen on {}".format(int(args.port)))
     httpd = make_server('', int(args.port), app)
+    startupDurationGauge.set(time.time() - start_time)
     httpd.serve_forever()
 
     try:
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+from cachetools import TTLCache
+
+'''
+PeriodCache keeps CloudMonitor datapoints until a newer datapoint can exist.
+
+CloudMonitor aggregates a metric over fixed windows of 'period' seconds, so
+the last datapoint of a metric cannot change before the current window
+closes. Entries are stored until the end of the current window, and only
+when the response already covers the last closed window; otherwise the data
+has not been ingested yet and the next scrape asks again.
+'''
+class PeriodCache(object):
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, now=None):
+        now = time.time() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None or now >= entry[0]:
+            return None
+        return entry[1]
+
+    def put(self, key, period: int, points, now=None, timestamp=None):
+        now = time.time() if now is None else now
+        window_start = now - now % period
+        if timestamp is None:
+            timestamp = max(point.get('timestamp', 0) for point in points)
+        latest = timestamp / 1000
+        if latest < window_start - period:
+            return
+        self._entries[key] = (window_start + period, points)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def dump(self):
+        return dict(self._entries)
+
+    def restore(self, entries, now=None):
+        now = time.time() if now is None else now
+        for key, entry in entries.items():
+            if now < entry[0]:
+                self._entries.setdefault(key, entry)
+
+
+'''
+RefreshingCache serves the last loaded value of a key while reloading it in
+the background.
+
+The first get() of a key loads it synchronously. Once an entry is older than
+'refresh_after' seconds the next get() still returns it immediately and
+starts a background reload; the entry is replaced only when the reload
+succeeds, so a failing API keeps the last good value in place.
+'''
+class RefreshingCache(object):
+
+    def __init__(self, refresh_after: float, on_refresh=None, expire_after: float = None, max_entries=1024):
+        self.refresh_after = refresh_after
+        self.on_refresh = on_refresh
+        # With 'expire_after', entries that were not reloaded for that long,
+        # i.e. not read for that long minus 'refresh_after', are evicted.
+        self._entries = {} if expire_after is None else TTLCache(max_entries, expire_after)
+        self._refreshing = set()
+        # key -> Future of the first load in flight
+        self._loading = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        entry = self.peek_entry(key)
+        if entry is None:
+            entry = self.load_once(key, loader)
+        if time.time() - entry[1] >= self.refresh_after:
+            self.refresh_async(key, loader)
+        return entry[0]
+
+    '''
+    Load a key that has no entry yet. Concurrent callers of the same key
+    wait for a single load, loads of different keys run in parallel.
+    '''
+    def load_once(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            entry = self.load(key, loader, raise_error=True)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(entry)
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        return entry
+
+    def peek_entry(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def peek(self, key):
+        entry = self.peek_entry(key)
+        return None if entry is None else entry[0]
+
+    def dump(self):
+        with self._lock:
+            return dict(self._entries.items())
+
+    '''
+    Put back entries with the time they were loaded at, so an entry older
+    than 'refresh_after' is served and refreshed right away.
+    '''
+    def restore(self, entries):
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries.setdefault(key, entry)
+
+    def age(self, key):
+        entry = self.peek_entry(key)
+        if entry is None:
+            return float('nan')
+        return time.time() - entry[1]
+
+    def refresh_async(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key, loader),
+                         name='refresh-{}'.format(key), daemon=True).start()
+
+    def _refresh(self, key, loader):
+        try:
+            self.load(key, loader, raise_error=False)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def load(self, key, loader, raise_error=False):
+        start_time = time.time()
+        try:
+            value = loader()
+        except Exception as e:
+            if self.on_refresh is not None:
+                self.on_refresh(key, time.time() - start_time, False)
+            if raise_error:
+                raise
+            logging.error('Error refreshing {}, keep serving the cached value'.format(key), exc_info=e)
+            return None
+        entry = (value, time.time())
+        with self._lock:
+            self._entries[key] = entry
+        if self.on_refresh is not None:
+            self.on_refresh(key, time.time() - start_time, True)
+        return entry
@@ -0,0 +1,178 @@
+import logging
+import time
+
+from datetime import datetime, timedelta
+from prometheus_client.core import GaugeMetricFamily
+from aliyunsdkcdn.request.v20180510 import DescribeDomainSrcHttpCodeDataRequest
+from aliyunsdkcdn.request.v20180510 import DescribeDomainSrcBpsDataRequest
+from aliyunsdkcdn.request.v20180510 import DescribeDomainRealTimeSrcHttpCodeDataRequest
+from aliyunsdkcdn.request.v20180510 import DescribeDomainRealTimeSrcBpsDataRequest
+
+from aliyun_exporter import decoding
+from aliyun_exporter.collector import AliyunCollector, cdn_performance, metric_up_gauge, timed_out
+
+
+class CDNPerformanceCollector:
+
+    def __init__(self, delegate: AliyunCollector):
+        self.parent = delegate
+        self.domain_queries = {
+            'DescribeDomainRealTimeSrcHttpCodeData': (self.query_cdn_domain_srccode_metrics, self.parse_cdn_domain_srccode),
+            'DescribeDomainRealTimeSrcBpsData': (self.query_cdn_domain_SBD_metrics, self.parse_cdn_domain_SBD),
+        }
+
+    '''
+    The real-time source APIs sum up the data of every domain passed in one
+    request, so per-domain series still need one request per domain. The
+    domain inventory is looked up once per scrape and the requests of every
+    configured metric are sent to the fetch pool up front. Requests not
+    done by the scrape deadline are left out, aliyun_cdn_performance_up is
+    0 then.
+    '''
+    def collect(self, deadline=None):
+        names = [metric_type['name'] for metric_type in self.parent.metrics[cdn_performance]]
+        window = self.realtime_window()
+        domains = []
+        up = True
+        if any(name in self.domain_queries for name in names):
+            domains = self.parent.wait_results([self.parent.pool.submit(self.parent.info_provider.instance_ids, 'cdn')],
+                                               deadline, cdn_performance)[0]
+            if domains is timed_out:
+                logging.error('Scrape deadline exceeded while fetching the cdn inventory')
+                domains = []
+                up = False
+        pending = dict()
+        for name in names:
+            if name in pending:
+                continue
+            if name == 'DescribeDomainSrcHttpCodeData':
+                pending[name] = [self.parent.pool.submit(self.query_cdn_srccode_metrics)]
+            elif name == 'DescribeDomainSrcBpsData':
+                pending[name] = [self.parent.pool.submit(self.query_cdn_SBD_metric)]
+            elif name in self.domain_queries:
+                query = self.domain_queries[name][0]
+                pending[name] = [self.parent.pool.submit(query, id, window) for id in domains]
+
+        for name in names:
+            if name not in pending:
+                continue
+            results = self.parent.wait_results(pending.pop(name), deadline, cdn_performance)
+            up = up and timed_out not in results
+            results = [None if result is timed_out else result for result in results]
+            if name == 'DescribeDomainSrcHttpCodeData':
+                for metric in results[0] or []:
+                    yield from self.parse_cdn_srccode(metric)
+            elif name == 'DescribeDomainSrcBpsData':
+                if results[0]:
+                    yield from self.parse_cdn_SBD(results[0])
+            else:
+                parse = self.domain_queries[name][1]
+                for id, metrics in zip(domains, results):
+                    for metric in metrics or []:
+                        yield from parse(id, metric)
+        yield metric_up_gauge('aliyun_' + cdn_performance, up)
+
+    def realtime_window(self):
+        now = datetime.utcnow()
+        one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
+        two_minute_ago_str = (now - timedelta(minutes=2)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
+        return two_minute_ago_str, one_minute_ago_str
+
+    def parse_cdn_domain_SBD(self, id, value: dict):
+        metric_name = 'DescribeDomainRealTimeSrcBpsData'
+        gauge = GaugeMetricFamily(
+            self.parent.format_metric_name(cdn_performance, metric_name),
+            '', labels=['cdnPerformance', 'instanceId'])
+        gauge.add_metric([metric_name, id], float(value['Value']))
+        yield gauge
+
+    def parse_cdn_domain_srccode(self, id, value: dict):
+        metrics: list = value['Value']['RealTimeSrcCodeProportionData']
+        if len(metrics) < 1:
+            return
+        metric_name = 'DescribeDomainRealTimeSrcHttpCodeData'
+        for metric in metrics:
+            gauge = GaugeMetricFamily(
+                self.parent.format_metric_name(cdn_performance, metric_name),
+                '', labels=['cdnPerformance', 'instanceId', 'httpCode'])
+            gauge.add_metric([metric_name, id, metric['Code']], float(metric['Proportion']))
+            yield gauge
+
+    def parse_cdn_srccode(self, metric):
+        metric_name = 'DescribeDomainSrcHttpCodeData'
+
+        gauge = GaugeMetricFamily(
+            self.parent.format_metric_name(cdn_performance, metric_name),
+            '', labels=['cdnPerformance', 'httpCode'])
+        gauge.add_metric([metric_name, metric['Code']], float(metric['Proportion']))
+        yield gauge
+
+    def parse_cdn_SBD(self, metric):
+        metric_name = 'DescribeDomainSrcBpsData'
+
+        for k, v in metric.items():
+            if k == "TimeStamp":
+                continue
+            gauge = GaugeMetricFamily(
+                self.parent.format_metric_name(cdn_performance, metric_name),
+                '', labels=['cdnPerformance', 'type'])
+            gauge.add_metric([metric_name, k], float(v))
+            yield gauge
+
+    def query_cdn_domain_SBD_metrics(self, id, window):
+        req = DescribeDomainRealTimeSrcBpsDataRequest.DescribeDomainRealTimeSrcBpsDataRequest()
+        req.set_DomainName(id)
+        req.set_StartTime(window[0])
+        req.set_EndTime(window[1])
+        try:
+            resp = self.parent.client.do_action_with_exception(req)
+        except Exception as e:
+            logging.error('Error request cdn performance api', exc_info=e)
+            return []
+        data = decoding.load_action(resp, req.get_action_name())
+        return data['RealTimeSrcBpsDataPerInterval']['DataModule']
+
+    def query_cdn_domain_srccode_metrics(self, id, window):
+        req = DescribeDomainRealTimeSrcHttpCodeDataRequest.DescribeDomainRealTimeSrcHttpCodeDataRequest()
+        req.set_DomainName(id)
+        req.set_StartTime(window[0])
+        req.set_EndTime(window[1])
+        try:
+            resp = self.parent.client.do_action_with_exception(req)
+        except Exception as e:
+            logging.error('Error request cdn performance api', exc_info=e)
+            return []
+        data = decoding.load_action(resp, req.get_action_name())
+        return data['RealTimeSrcHttpCodeData']['UsageData']
+
+    def query_cdn_srccode_metrics(self,):
+        req = DescribeDomainSrcHttpCodeDataRequest.DescribeDomainSrcHttpCodeDataRequest()
+        now = time.time() - 300
+        start_time = datetime.utcfromtimestamp(now - 600).strftime("%Y-%m-%dT%H:%M:%SZ")
+        end_time = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%SZ")
+        req.set_accept_format('json')
+        req.set_StartTime(start_time)
+        req.set_EndTime(end_time)
+        try:
+            resp = self.parent.client.do_action_with_exception(req)
+        except Exception as e:
+            logging.error('Error request rds performance api', exc_info=e)
+            return []
+        data = decoding.load_action(resp, req.get_action_name())
+        return data['HttpCodeData']['UsageData'][0]['Value']['CodeProportionData']
+
+    def query_cdn_SBD_metric(self):
+        req = DescribeDomainSrcBpsDataRequest.DescribeDomainSrcBpsDataRequest()
+        now = time.time() - 300
+        start_time = datetime.utcfromtimestamp(now - 600).strftime("%Y-%m-%dT%H:%M:%SZ")
+        end_time = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%SZ")
+        req.set_accept_format('json')
+        req.set_StartTime(start_time)
+        req.set_EndTime(end_time)
+        try:
+            resp = self.parent.client.do_action_with_exception(req)
+        except Exception as e:
+            logging.error('Error request rds performance api', exc_info=e)
+            return []
+        data = decoding.load_action(resp, req.get_action_name())
+        return data['SrcBpsDataPerInterval']['DataModule'][0]
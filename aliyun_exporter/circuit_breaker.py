@@ -0,0 +1,79 @@
+import threading
+import time
+
+from prometheus_client import Gauge
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+circuitStateGauge = Gauge('aliyun_exporter_circuit_state',
+                          'State of the circuit breaker of a metric, 0 closed, 1 open, 2 half-open',
+                          ['project', 'metric', 'region'])
+
+'''
+CircuitBreaker stops querying a (project, metric, region) that keeps failing.
+
+After 'threshold' consecutive failures the circuit opens and the metric is
+skipped for 'base_delay' seconds, doubled on every further failure up to
+'max_delay'. When the delay is over a single probe is let through
+(half-open): success closes the circuit, failure opens it again for longer.
+'''
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=3, base_delay=60, max_delay=3600):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # key -> [consecutive failures, open until, probe in flight]
+        self.entries = dict()
+        # keys with a circuitStateGauge series
+        self.reported = set()
+        self._lock = threading.Lock()
+
+    def allow(self, key) -> bool:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < self.threshold:
+                return True
+            if time.time() < entry[1] or entry[2]:
+                return False
+            entry[2] = True
+            self.reported.add(key)
+        circuitStateGauge.labels(*key).set(HALF_OPEN)
+        return True
+
+    def half_open(self, key) -> bool:
+        with self._lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[2]
+
+    def record_success(self, key):
+        with self._lock:
+            entry = self.entries.pop(key, None)
+        if entry is not None and entry[0] >= self.threshold:
+            circuitStateGauge.labels(*key).set(CLOSED)
+
+    def record_failure(self, key):
+        with self._lock:
+            entry = self.entries.setdefault(key, [0, 0, False])
+            entry[0] += 1
+            entry[2] = False
+            if entry[0] < self.threshold:
+                return
+            delay = min(self.max_delay, self.base_delay * 2 ** (entry[0] - self.threshold))
+            entry[1] = time.time() + delay
+            self.reported.add(key)
+        circuitStateGauge.labels(*key).set(OPEN)
+
+    def keys(self):
+        with self._lock:
+            return set(self.entries) | self.reported
+
+    def discard(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+            reported = key in self.reported
+            self.reported.discard(key)
+        if reported:
+            circuitStateGauge.remove(*key)
@@ -0,0 +1,170 @@
+import inspect
+import os
+import threading
+import time
+
+from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.http.http_response import DEFAULT_CONNECT_TIMEOUT, HttpResponse
+from aliyunsdkcore.vendored.requests import Request, Session
+from aliyunsdkcore.vendored.requests.adapters import HTTPAdapter
+from aliyunsdkcore.vendored.requests.packages.urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from prometheus_client import Counter, Gauge, Summary
+
+connectionWaitSummary = Summary('aliyun_exporter_http_connection_wait_seconds',
+                                'Time spent waiting for a pooled connection', ['endpoint'])
+connectionRequestCounter = Counter('aliyun_exporter_http_connection_requests',
+                                   'Requests sent over pooled connections', ['endpoint'])
+connectionCreatedCounter = Counter('aliyun_exporter_http_connections_created',
+                                   'Connections opened to Aliyun endpoints', ['endpoint'])
+connectionReuseGauge = Gauge('aliyun_exporter_http_connection_reuse_ratio',
+                             'Share of requests sent over an already open connection', ['endpoint'])
+
+
+# endpoint -> [requests, connections created]
+_pool_stats = dict()
+_pool_stats_lock = threading.Lock()
+
+
+def _record_connection(endpoint, created):
+    with _pool_stats_lock:
+        if endpoint not in _pool_stats:
+            _pool_stats[endpoint] = [0, 0]
+            connectionReuseGauge.labels(endpoint).set_function(lambda: reuse_ratio(endpoint))
+        _pool_stats[endpoint][1 if created else 0] += 1
+
+
+def reuse_ratio(endpoint):
+    requests, created = _pool_stats.get(endpoint, (0, 0))
+    if requests == 0:
+        return float('nan')
+    return max(0.0, 1.0 - created / requests)
+
+
+class _InstrumentedPoolMixin(object):
+
+    def _get_conn(self, timeout=None):
+        start_time = time.time()
+        conn = super()._get_conn(timeout)
+        connectionWaitSummary.labels(self.host).observe(time.time() - start_time)
+        connectionRequestCounter.labels(self.host).inc()
+        _record_connection(self.host, created=False)
+        return conn
+
+    def _new_conn(self):
+        connectionCreatedCounter.labels(self.host).inc()
+        _record_connection(self.host, created=True)
+        return super()._new_conn()
+
+
+class _InstrumentedHTTPConnectionPool(_InstrumentedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _InstrumentedHTTPSConnectionPool(_InstrumentedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _PooledAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _InstrumentedHTTPConnectionPool,
+            'https': _InstrumentedHTTPSConnectionPool,
+        }
+
+
+# Newer core SDKs keep a Session per client and take 'pool_size' themselves
+native_session = 'pool_size' in inspect.signature(AcsClient.__init__).parameters
+
+
+'''
+Older core SDKs open a new Session, hence a new TCP/TLS connection, for
+every request. PooledHttpResponse wraps the response object the SDK built
+and sends it through the client's long-lived Session instead, so
+connections to an endpoint are kept alive and reused across requests and
+threads. Only public getters of the SDK response are used, and
+certificates are verified the way newer SDKs do.
+'''
+class PooledHttpResponse(object):
+
+    def __init__(self, response: HttpResponse, session: Session, port, timeout):
+        self.response = response
+        self.session = session
+        self.port = port
+        self.timeout = timeout
+
+    def get_verify_value(self):
+        if hasattr(self.response, 'get_verify_value'):
+            return self.response.get_verify_value()
+        return os.environ.get('ALIBABA_CLOUD_CA_BUNDLE', True)
+
+    def get_response_object(self):
+        response = self.response
+        current_protocol = 'https://' if response.get_ssl_enabled() else 'http://'
+        url = current_protocol + response.get_host() + response.get_url()
+        if self.port != 80:
+            url = current_protocol + response.get_host() + ":" + str(self.port) + response.get_url()
+        req = Request(method=response.get_method(), url=url,
+                      data=response.get_body(),
+                      headers=response.get_headers(),
+                      )
+        prepped = self.session.prepare_request(req)
+        proxies = {
+            "http": os.environ.get('HTTP_PROXY') or os.environ.get('http_proxy'),
+            "https": os.environ.get('HTTPS_PROXY') or os.environ.get('https_proxy'),
+        }
+        response = self.session.send(prepped, proxies=proxies,
+                                     timeout=(DEFAULT_CONNECT_TIMEOUT, self.timeout),
+                                     allow_redirects=False, verify=self.get_verify_value())
+        return response.status_code, response.headers, response.content
+
+
+'''
+AcsClient keeping persistent connections, at most 'pool_size' per endpoint.
+
+Newer SDKs already send every request through the client's Session, its
+adapters are only replaced by instrumented ones. Older SDKs get a Session
+here and their responses are sent through it by PooledHttpResponse.
+'''
+class PooledAcsClient(AcsClient):
+
+    def __init__(self, *args, pool_size=10, **kwargs):
+        if native_session:
+            super().__init__(*args, pool_size=pool_size, **kwargs)
+        else:
+            super().__init__(*args, **kwargs)
+            self.session = Session()
+        adapter = _PooledAdapter(pool_connections=10, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    if not native_session:
+        def _make_http_response(self, endpoint, request, timeout, specific_signer=None):
+            response = super()._make_http_response(endpoint, request, timeout, specific_signer)
+            return PooledHttpResponse(response, self.session, self.get_port(), timeout)
+
+
+'''
+ClientPool hands out one PooledAcsClient per credential and region, so
+every component talking to the same account and region shares its
+connections.
+'''
+class ClientPool(object):
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.clients = dict()
+        self._lock = threading.Lock()
+
+    def get(self, access_key_id, access_key_secret, region_id) -> PooledAcsClient:
+        key = (access_key_id, access_key_secret, region_id)
+        with self._lock:
+            if key not in self.clients:
+                self.clients[key] = PooledAcsClient(
+                    ak=access_key_id,
+                    secret=access_key_secret,
+                    region_id=region_id,
+                    pool_size=self.pool_size
+                )
+            return self.clients[key]
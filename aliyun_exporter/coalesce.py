@@ -0,0 +1,74 @@
+import threading
+import time
+
+from prometheus_client import Counter
+
+from aliyun_exporter.deadline import get_deadline
+from aliyun_exporter.polling import Snapshot
+
+coalescedCounter = Counter('aliyun_exporter_coalesced_scrapes', 'Scrapes served by a collection shared with another scrape')
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.families = None
+        self.error = None
+
+
+'''
+CoalescingCollector lets concurrent scrapes share one collection.
+
+A scrape arriving while another one is collecting waits for that collection
+and serves its result instead of starting its own. With a 'window' > 0, a
+scrape arriving less than 'window' seconds after a collection finished
+reuses its result as well, so HA Prometheus replicas scraping at nearly the
+same time cost a single round of API calls. A waiting scrape gives up at
+its own deadline and serves the previous result instead.
+'''
+class CoalescingCollector(object):
+
+    def __init__(self, delegate, window: float = 0):
+        self.delegate = delegate
+        self.window = window
+        self.last = None
+        self._flight = None
+        self._lock = threading.Lock()
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        with self._lock:
+            if self.last is not None and time.time() - self.last.timestamp < self.window:
+                coalescedCounter.inc()
+                return self.last.families
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+        if leader:
+            try:
+                flight.families = tuple(self.delegate.collect())
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flight = None
+                    if flight.error is None:
+                        self.last = Snapshot(flight.families, time.time())
+                flight.done.set()
+        else:
+            coalescedCounter.inc()
+            deadline = get_deadline()
+            if not flight.done.wait(None if deadline is None else max(0.0, deadline - time.time())):
+                # Past our own deadline, fall back to the last result if any
+                with self._lock:
+                    last = self.last
+                if last is None:
+                    raise TimeoutError('Scrape deadline exceeded while waiting for a shared collection')
+                return last.families
+        if flight.error is not None:
+            raise flight.error
+        return flight.families
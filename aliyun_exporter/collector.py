@@ -1,32 +1,51 @@
+import hashlib
 import json
 import logging
+import threading
 import time
 import os
 
-from datetime import datetime, timedelta
-from prometheus_client import Summary
-from prometheus_client.core import GaugeMetricFamily, REGISTRY
-from aliyunsdkcore.client import AcsClient
+from functools import lru_cache
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from prometheus_client import Counter, Summary
+from prometheus_client.core import GaugeMetricFamily, Metric, REGISTRY
 from aliyunsdkcms.request.v20180308 import QueryMetricLastRequest
-from aliyunsdkrds.request.v20140815 import DescribeDBInstancePerformanceRequest
-from aliyunsdkcdn.request.v20180510 import DescribeDomainSrcHttpCodeDataRequest
-from aliyunsdkcdn.request.v20180510 import DescribeDomainSrcBpsDataRequest
-from aliyunsdkcdn.request.v20180510 import DescribeDomainRealTimeSrcHttpCodeDataRequest
-from aliyunsdkcdn.request.v20180510 import DescribeDomainRealTimeSrcBpsDataRequest
-from ratelimiter import RateLimiter
 
-from aliyun_exporter.info_provider import InfoProvider
-from aliyun_exporter.utils import try_or_else
+from aliyun_exporter import decoding
+from aliyun_exporter.cache import PeriodCache
+from aliyun_exporter.circuit_breaker import CircuitBreaker
+from aliyun_exporter.client_pool import ClientPool
+from aliyun_exporter.columns import DatapointTable
+from aliyun_exporter.deadline import get_deadline
+from aliyun_exporter.info_provider import InfoProvider, id_labels
+from aliyun_exporter.instrumentation import scrapePhaseHistogram
+from aliyun_exporter.plugins import LazyRegistry
+from aliyun_exporter.ratelimit import RateLimitedClient, RateLimiters
 
 rds_performance = 'rds_performance'
 cdn_performance = 'cdn_performance'
-special_projects = {
-    rds_performance: lambda collector : RDSPerformanceCollector(collector),
-    cdn_performance: lambda collector : CDNPerformanceCollector(collector),
-}
+
+# Result of wait_results() for a task not done by the deadline, None being
+# a valid result (an inventory without instances has no family)
+timed_out = object()
+# InfoProvider resource -> label holding the instance id used as CloudMonitor dimension
+inventory_dimensions = {resource: label for resource, label in id_labels.items() if resource != 'cdn'}
+# Special project -> collector, imported only when a config uses the project
+special_projects = LazyRegistry('special project', {
+    rds_performance: 'aliyun_exporter.rds_performance:RDSPerformanceCollector',
+    cdn_performance: 'aliyun_exporter.cdn_performance:CDNPerformanceCollector',
+})
 
 requestSummary = Summary('cloudmonitor_request_latency_seconds', 'CloudMonitor request latency', ['project'])
 requestFailedSummary = Summary('cloudmonitor_failed_request_latency_seconds', 'CloudMonitor failed request latency', ['project'])
+hedgedRequestCounter = Counter('cloudmonitor_hedged_requests', 'Hedged CloudMonitor fetches', ['project'])
+deadlineExceededCounter = Counter('cloudmonitor_deadline_exceeded',
+                                  'CloudMonitor fetches abandoned at the scrape deadline', ['project'])
+regionFetchSummary = Summary('cloudmonitor_region_fetch_latency_seconds',
+                             'Latency of fetching one CloudMonitor metric per region', ['region'])
+cachedResponseCounter = Counter('cloudmonitor_cached_responses',
+                                'CloudMonitor responses served from the period cache', ['project'])
 
 class CollectorConfig(object):
     def __init__(self,
@@ -35,14 +54,43 @@ class CollectorConfig(object):
                  credential=None,
                  metrics=None,
                  info_metrics=None,
+                 polling_interval=None,
+                 period_cache=True,
+                 inventory_ttl=3600,
+                 scrape_timeout=None,
+                 scrape_timeout_offset=0.5,
+                 hedge_after=None,
+                 circuit_breaker=None,
+                 regions=None,
+                 coalesce_window=0,
+                 connection_pool_size=None,
+                 state_file=None,
+                 state_interval=60,
+                 metadata_ttl=3600,
+                 info_labels=None,
                  ):
         # if metrics is None:
         # raise Exception('Metrics config must be set.')
 
         self.credential = credential
         self.metrics = metrics
+        self.pool_size = pool_size
         self.rate_limit = rate_limit
         self.info_metrics = info_metrics
+        self.polling_interval = polling_interval
+        self.period_cache = period_cache
+        self.inventory_ttl = inventory_ttl
+        self.scrape_timeout = scrape_timeout
+        self.scrape_timeout_offset = scrape_timeout_offset
+        self.hedge_after = hedge_after
+        self.circuit_breaker = circuit_breaker
+        self.regions = regions
+        self.coalesce_window = coalesce_window
+        self.connection_pool_size = connection_pool_size or pool_size
+        self.state_file = state_file
+        self.state_interval = state_interval
+        self.metadata_ttl = metadata_ttl
+        self.info_labels = info_labels
 
         # ENV
         access_id = os.environ.get('ALIYUN_ACCESS_ID')
@@ -60,53 +108,270 @@ class CollectorConfig(object):
                 self.credential['access_key_secret'] is None:
             raise Exception('Credential is not fully configured.')
 
-class AliyunCollector(object):
-    def __init__(self, config: CollectorConfig):
-        self.metrics = config.metrics
-        self.info_metrics = config.info_metrics
-        self.client = AcsClient(
-            ak=config.credential['access_key_id'],
-            secret=config.credential['access_key_secret'],
-            region_id=config.credential['region_id']
-        )
-        self.rateLimiter = RateLimiter(max_calls=config.rate_limit)
-        self.info_provider = InfoProvider(self.client)
-        self.special_collectors = dict()
-        for k, v in special_projects.items():
-            if k in self.metrics:
-                self.special_collectors[k] = v(self)
+'''
+SharedResources holds what several collectors served by one process share:
+the rate-limit budget, the connection pool, one client per credential and
+region, and the InfoProvider (with its inventory cache) on top of each
+client.
+
+The rate-limit budget, connection pool size, inventory TTL, inventory pool
+size and info_labels are taken from the first config that asks for them.
+'''
+class SharedResources(object):
+
+    def __init__(self):
+        self.rate_limiters = None
+        self.client_pool = None
+        self.clients = dict()
+        self.info_providers = dict()
+        self._lock = threading.Lock()
+
+    def client_key(self, config: CollectorConfig, region=None):
+        return (config.credential['access_key_id'],
+                config.credential['access_key_secret'],
+                region or config.credential['region_id'])
+
+    def client(self, config: CollectorConfig, region=None):
+        key = self.client_key(config, region)
+        with self._lock:
+            if self.rate_limiters is None:
+                self.rate_limiters = RateLimiters(config.rate_limit)
+            if self.client_pool is None:
+                self.client_pool = ClientPool(config.connection_pool_size)
+            if key not in self.clients:
+                self.clients[key] = RateLimitedClient(self.client_pool.get(*key), self.rate_limiters)
+            return self.clients[key]
+
+    '''
+    Client of the metadata browser. Its calls share the connections of the
+    scrape client but take tokens from their own 'cms-meta' bucket, so
+    browsing never eats into the scrape budget.
+    '''
+    def metadata_client(self, config: CollectorConfig, region=None):
+        client = self.client(config, region)
+        return RateLimitedClient(client.client, self.rate_limiters, product='cms-meta')
+
+    def info_provider(self, config: CollectorConfig, region=None):
+        client = self.client(config, region)
+        key = self.client_key(config, region)
+        with self._lock:
+            if key not in self.info_providers:
+                self.info_providers[key] = InfoProvider(client, ttl=config.inventory_ttl, pool_size=config.pool_size,
+                                                        info_labels=config.info_labels, region=key[2])
+            return self.info_providers[key]
 
 
-    def query_metric(self, project: str, metric: str, period: int):
-        with self.rateLimiter:
+class AliyunCollector(object):
+    def __init__(self, config: CollectorConfig, shared: SharedResources = None):
+        if shared is None:
+            shared = SharedResources()
+        self.pools = dict()
+        self.pool_size = None
+        self.period_cache = None
+        self.circuit_breaker = None
+        self.circuit_breaker_config = None
+        self.special_collectors = dict()
+        # (project, metric, period, region) -> (period cache key, last DatapointTable)
+        self.tables = dict()
+        # (project, name, measure, period, region) -> (DatapointTable, gauge built from it).
+        # The gauge is the object the render cache keeps for its text anyway,
+        # holding it here only costs the entry.
+        self.families = dict()
+        # family name -> ([(region, family)] merged last time, merged family)
+        self.merged = dict()
+        # Held while a scrape submits its fetches and while a config is applied
+        self._config_lock = threading.Lock()
+        self.reconfigure(config, shared)
+
+    '''
+    Apply a config, the one the collector is built with or a reloaded one.
+
+    Pools of unchanged regions, the circuit breaker, the period cache and the
+    datapoints of metrics that are still configured are kept, and clients and
+    inventory come from the shared resources, so a reload only starts what
+    changed cold.
+    '''
+    def reconfigure(self, config: CollectorConfig, shared: SharedResources):
+        region_ids = list(config.regions or [config.credential['region_id']])
+        # Everything that can fail is built first, the collector keeps its
+        # previous config until the new one is swapped in as a whole.
+        pools = dict()
+        try:
+            clients = {region: shared.client(config, region) for region in region_ids}
+            info_providers = {region: shared.info_provider(config, region) for region in region_ids}
+            # Each region fetches on its own pool so a slow region cannot hold
+            # the workers of the others.
+            for region in region_ids:
+                if region in self.pools and config.pool_size == self.pool_size:
+                    pools[region] = self.pools[region]
+                else:
+                    pools[region] = ThreadPoolExecutor(max_workers=config.pool_size,
+                                                       thread_name_prefix='cms-fetch-' + region)
+            circuit_breaker = self.circuit_breaker
+            if config.circuit_breaker != self.circuit_breaker_config or circuit_breaker is None:
+                circuit_breaker = None
+                if config.circuit_breaker is not False:
+                    circuit_breaker = CircuitBreaker(**(config.circuit_breaker or {}))
+            special_collectors = dict()
+            for k in special_projects:
+                if k in config.metrics:
+                    special_collectors[k] = self.special_collectors.get(k) or special_projects.get(k)(self)
+        except Exception:
+            for region, pool in pools.items():
+                if self.pools.get(region) is not pool:
+                    pool.shutdown(wait=False)
+            raise
+        with self._config_lock:
+            old_pools = [pool for region, pool in self.pools.items() if pools.get(region) is not pool]
+            self.metrics = config.metrics
+            self.info_metrics = config.info_metrics
+            # With 'regions' configured every series gets a region label, the
+            # first region is the one used by the special collectors.
+            self.regions = config.regions
+            self.region_ids = region_ids
+            self.clients = clients
+            self.info_providers = info_providers
+            self.pools = pools
+            self.pool_size = config.pool_size
+            self.client = self.clients[self.region_ids[0]]
+            self.info_provider = self.info_providers[self.region_ids[0]]
+            self.pool = self.pools[self.region_ids[0]]
+            self.rate_limiters = shared.rate_limiters
+            if not config.period_cache:
+                self.period_cache = None
+            elif self.period_cache is None:
+                self.period_cache = PeriodCache()
+            self.scrape_timeout = config.scrape_timeout
+            self.scrape_timeout_offset = config.scrape_timeout_offset
+            self.hedge_after = config.hedge_after
+            self.circuit_breaker = circuit_breaker
+            self.circuit_breaker_config = config.circuit_breaker
+            self.special_collectors = special_collectors
+        self.prune_cached_metrics()
+        for pool in old_pools:
+            pool.shutdown(wait=False)
+
+    '''
+    Drop the datapoints and circuit breaker state kept for metrics that are
+    no longer configured. Fetches still in flight may add entries meanwhile,
+    so the keys are copied before they are looked at.
+    '''
+    def prune_cached_metrics(self):
+        tables = set()
+        families = set()
+        breakers = set()
+        for project, metrics in self.metrics.items():
+            if project in special_projects:
+                continue
+            for metric in metrics:
+                if 'name' not in metric:
+                    continue
+                period = metric.get('period', 60)
+                for region in self.region_ids:
+                    tables.add((project, metric['name'], period, region))
+                    families.add((project, metric.get('rename', metric['name']),
+                                  metric.get('measure', 'Average'), period, region))
+                    breakers.add((project, metric['name'], region))
+        for key in list(self.tables):
+            if key not in tables:
+                entry = self.tables.pop(key, None)
+                if entry is not None and self.period_cache is not None:
+                    self.period_cache.discard(entry[0])
+        for key in list(self.families):
+            if key not in families:
+                self.families.pop(key, None)
+        self.merged = dict()
+        if self.circuit_breaker is not None:
+            for key in self.circuit_breaker.keys():
+                if key not in breakers:
+                    self.circuit_breaker.discard(key)
+
+    '''
+    Stream the datapoints of a metric, following the response cursor until
+    every page has been read.
+    '''
+    def query_metric(self, project: str, metric: str, period: int, dimensions=None, region=None):
+        cursor = None
+        while True:
             req = QueryMetricLastRequest.QueryMetricLastRequest()
             req.set_Project(project)
             req.set_Metric(metric)
             req.set_Period(period)
+            if dimensions is not None:
+                req.set_Dimensions(json.dumps(dimensions))
+            if cursor is not None:
+                req.set_Cursor(cursor)
             start_time = time.time()
             try:
-                resp = self.client.do_action_with_exception(req)
-            except Exception as e:
-                logging.error('Error request cloud monitor api', exc_info=e)
+                resp = self.clients.get(region, self.client).do_action_with_exception(req)
+            except Exception:
                 requestFailedSummary.labels(project).observe(time.time() - start_time)
-                return []
+                raise
             else:
                 requestSummary.labels(project).observe(time.time() - start_time)
-        data = json.loads(resp)
-        if 'Datapoints' in data:
-            points = json.loads(data['Datapoints'])
-            return points
-        else:
-            logging.error('Error query metrics for {}_{}, the response body don not have Datapoints field, please check you permission or workload' .format(project, metric))
-            return None
-
-    def parse_label_keys(self, point):
-        return [k for k in point if k not in ['timestamp', 'Maximum', 'Minimum', 'Average', 'Sum']]
+            points, cursor = decoding.load_datapoints(resp)
+            if points is None:
+                logging.error('Error query metrics for {}_{}, the response body don not have Datapoints field, '
+                              'please check you permission or workload'.format(project, metric))
+                return
+            yield from points
+            if not cursor:
+                return
+
+    '''
+    Query the metric for every chunk of the dimension filter, or for the
+    whole project if the metric has no filter.
+    '''
+    def query_metric_chunks(self, project: str, metric: str, period: int, dimensions=None, chunk_size=50, region=None):
+        if dimensions is None:
+            yield from self.query_metric(project, metric, period, region=region)
+            return
+        for i in range(0, len(dimensions), chunk_size):
+            yield from self.query_metric(project, metric, period, dimensions[i:i + chunk_size], region)
+
+    '''
+    Serve the datapoints from the period cache while the aggregation window
+    of the last response is still open, otherwise query CloudMonitor and
+    store the response as a DatapointTable. The resolved dimension filter is
+    part of the period cache key, so a changed filter is queried again.
+    '''
+    def cached_query_metric(self, project: str, metric: str, period: int, dimensions=None, chunk_size=50, region=None):
+        table_key = (project, metric, period, region)
+        key = table_key + (dimensions_key(dimensions),)
+        if self.period_cache is not None:
+            table = self.period_cache.get(key)
+            if table is not None:
+                cachedResponseCounter.labels(project).inc()
+                return table
+        points = self.query_metric_chunks(project, metric, period, dimensions, chunk_size, region)
+        last = self.tables.get(table_key)
+        table = DatapointTable.from_points(points, previous=None if last is None else last[1])
+        if last is not None and last[0] != key and self.period_cache is not None:
+            self.period_cache.discard(last[0])
+        self.tables[table_key] = (key, table)
+        if self.period_cache is not None and len(table) > 0:
+            self.period_cache.put(key, period, table, timestamp=table.latest_timestamp())
+        return table
+
+    '''
+    Build the Dimensions filter of a metric, either listed in the config or
+    taken from the instance ids of an InfoProvider resource.
+    '''
+    def metric_dimensions(self, metric, region=None):
+        if 'dimensions' in metric:
+            return metric['dimensions']
+        if 'dimensions_from' in metric:
+            resource = metric['dimensions_from']
+            if resource not in inventory_dimensions:
+                raise Exception('dimensions_from must be one of {}.'.format(', '.join(inventory_dimensions)))
+            ids = self.info_providers.get(region, self.info_provider).instance_ids(resource)
+            return [{'instanceId': id} for id in ids]
+        return None
 
     def format_metric_name(self, project, name):
         return 'aliyun_{}_{}'.format(project, name)
 
-    def metric_generator(self, project, metric):
+    def metric_generator(self, project, metric, region=None):
         if 'name' not in metric:
             raise Exception('name must be set in metric item.')
         name = metric['name']
@@ -120,215 +385,250 @@ class AliyunCollector(object):
         if 'measure' in metric:
             measure = metric['measure']
 
+        gauge = None
+        family_key = (project, name, measure, period, region)
         try:
-            points = self.query_metric(project, metric_name, period)
+            dimensions = self.metric_dimensions(metric, region)
+            if dimensions is not None and len(dimensions) < 1:
+                yield metric_up_gauge(self.format_metric_name(project, name), False)
+                return
+            chunk_size = metric.get('dimensions_chunk_size', 50)
+            table = self.cached_query_metric(project, metric_name, period, dimensions, chunk_size, region)
+            cached = self.families.get(family_key)
+            if cached is not None and cached[0] is table:
+                # Same datapoints as last scrape, hand out the same family so
+                # its rendered exposition text can be reused
+                gauge = cached[1]
+            elif len(table) > 0:
+                gauge = GaugeMetricFamily(self.format_metric_name(project, name), '', labels=table.label_keys)
+                for row, value in zip(table.rows, table.column(measure)):
+                    gauge.add_metric(row, value)
+                self.families[family_key] = (table, gauge)
         except Exception as e:
             logging.error('Error query metrics for {}_{}'.format(project, metric_name), exc_info=e)
             yield metric_up_gauge(self.format_metric_name(project, name), False)
             return
-        if len(points) < 1:
+        if gauge is None:
             yield metric_up_gauge(self.format_metric_name(project, name), False)
             return
-        label_keys = self.parse_label_keys(points[0])
-        gauge = GaugeMetricFamily(self.format_metric_name(project, name), '', labels=label_keys)
-        for point in points:
-            gauge.add_metric([try_or_else(lambda: str(point[k]), '') for k in label_keys], point[measure])
         yield gauge
         yield metric_up_gauge(self.format_metric_name(project, name), True)
 
-    def collect(self):
-        for project in self.metrics:
-            if project in special_projects:
-                continue
-            for metric in self.metrics[project]:
-                yield from self.metric_generator(project, metric)
-        if self.info_metrics != None:
-            for resource in self.info_metrics:
-                yield self.info_provider.get_metrics(resource)
-        for v in self.special_collectors.values():
-            yield from v.collect()
-
-
-
-def metric_up_gauge(resource: str, succeeded=True):
-    metric_name = resource + '_up'
-    description = 'Did the {} fetch succeed.'.format(resource)
-    return GaugeMetricFamily(metric_name, description, value=int(succeeded))
+    def breaker_key(self, project, metric, region=None):
+        return project, metric.get('name'), region or self.region_ids[0]
 
+    '''
+    Whether the circuit breaker lets a fetch through, the breaker outcome of
+    an allowed fetch is recorded once by wait_fetch.
+    '''
+    def allow_fetch(self, project, metric, region=None):
+        return self.circuit_breaker is None or self.circuit_breaker.allow(self.breaker_key(project, metric, region))
 
-class RDSPerformanceCollector:
-
-    def __init__(self, delegate: AliyunCollector):
-        self.parent = delegate
-
-    def collect(self):
-        for id in [s.labels['DBInstanceId'] for s in self.parent.info_provider.get_metrics('rds').samples]:
-            metrics = self.query_rds_performance_metrics(id)
-            for metric in metrics:
-                yield from self.parse_rds_performance(id, metric)
-
-    def parse_rds_performance(self, id, value):
-        value_format: str = value['ValueFormat']
-        metric_name = value['Key']
-        keys = ['value']
-        if value_format is not None and '&' in value_format:
-            keys = value_format.split('&')
-        metric = value['Values']['PerformanceValue']
-        if len(metric) < 1:
+    def record_fetch(self, key, succeeded):
+        if self.circuit_breaker is None:
             return
-        values = metric[0]['Value'].split('&')
-        for k, v in zip(keys, values):
-            gauge = GaugeMetricFamily(
-                self.parent.format_metric_name(rds_performance, metric_name + '_' + k),
-                '', labels=['instanceId'])
-            gauge.add_metric([id], float(v))
-            yield gauge
-
-    def query_rds_performance_metrics(self, id):
-        req = DescribeDBInstancePerformanceRequest.DescribeDBInstancePerformanceRequest()
-        req.set_DBInstanceId(id)
-        req.set_Key(','.join([metric['name'] for metric in self.parent.metrics[rds_performance]]))
-        now = datetime.utcnow()
-        now_str = now.replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        req.set_StartTime(one_minute_ago_str)
-        req.set_EndTime(now_str)
+        if succeeded:
+            self.circuit_breaker.record_success(key)
+        else:
+            self.circuit_breaker.record_failure(key)
+
+    '''
+    Run metric_generator to completion on a worker of the fetch pool, so that
+    collect can issue the CloudMonitor requests concurrently.
+    '''
+    def fetch_metric(self, project, metric, region=None):
+        start_time = time.time()
         try:
-            resp = self.parent.client.do_action_with_exception(req)
-        except Exception as e:
-            logging.error('Error request rds performance api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        return data['PerformanceKeys']['PerformanceKey']
-
-class CDNPerformanceCollector:
-
-    def __init__(self, delegate: AliyunCollector):
-        self.parent = delegate
+            return list(self.metric_generator(project, metric, region))
+        finally:
+            regionFetchSummary.labels(region or self.region_ids[0]).observe(time.time() - start_time)
+
+    def submit_fetch(self, project, metric, region):
+        return self.pools[region].submit(self.fetch_metric, project, metric, region)
+
+    '''
+    Wait for a fetch until the scrape deadline. If hedge_after is set and the
+    fetch is still running after that many seconds, a duplicate fetch is
+    sent and whichever finishes first wins. The outcome is recorded in the
+    circuit breaker once for both attempts, a fetch not done by the deadline
+    being a failure. A half-open probe is never hedged, it is meant to be the
+    only call.
+    '''
+    def wait_fetch(self, task, deadline, project, metric, region):
+        key = self.breaker_key(project, metric, region)
+        try:
+            families = self.wait_hedged(task, deadline, project, metric, region, key)
+        except BaseException:
+            self.record_fetch(key, False)
+            raise
+        self.record_fetch(key, fetch_succeeded(families))
+        return families
+
+    def wait_hedged(self, task, deadline, project, metric, region, key):
+        tasks = [task]
+        hedge = self.hedge_after is not None and not (self.circuit_breaker is not None
+                                                      and self.circuit_breaker.half_open(key))
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            if hedge and len(tasks) < 2:
+                timeout = self.hedge_after if timeout is None else min(timeout, self.hedge_after)
+            done, _ = wait(tasks, timeout=timeout, return_when=FIRST_COMPLETED)
+            if done:
+                return done.pop().result()
+            if deadline is not None and time.time() >= deadline:
+                for t in tasks:
+                    t.cancel()
+                raise TimeoutError()
+            if hedge and len(tasks) < 2 and task.running() and region in self.pools:
+                hedgedRequestCounter.labels(project).inc()
+                tasks.append(self.submit_fetch(project, metric, region))
+
+    '''
+    Results of the tasks in order, timed_out for the tasks not done by the
+    deadline: those are cancelled and counted as exceeded for 'project'.
+    Errors of the tasks are raised.
+    '''
+    def wait_results(self, tasks, deadline, project):
+        results = []
+        for task in tasks:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                results.append(task.result(timeout=timeout))
+            except FutureTimeoutError:
+                task.cancel()
+                deadlineExceededCounter.labels(project).inc()
+                results.append(timed_out)
+        return results
+
+    def scrape_deadline(self):
+        deadline = get_deadline()
+        if deadline is None and self.scrape_timeout is not None:
+            deadline = time.time() + self.scrape_timeout - self.scrape_timeout_offset
+        return deadline
 
     def collect(self):
-        for metric_type in self.parent.metrics[cdn_performance]:
-            if metric_type['name'] == 'DescribeDomainSrcHttpCodeData':
-                metrics = self.query_cdn_srccode_metrics()
-                for metric in metrics:
-                    yield from self.parse_cdn_srccode(metric)
-            elif metric_type['name'] == 'DescribeDomainSrcBpsData':
-                metric = self.query_cdn_SBD_metric()
-                yield from self.parse_cdn_SBD(metric)
-            elif metric_type['name'] == 'DescribeDomainRealTimeSrcHttpCodeData':
-                for id in [s.labels['DomainName'] for s in self.parent.info_provider.get_metrics('cdn').samples]:
-                    metrics = self.query_cdn_domain_srccode_metrics(id)
-                    for metric in metrics:
-                        yield from self.parse_cdn_domain_srccode(id, metric)
-            elif metric_type['name'] == 'DescribeDomainRealTimeSrcBpsData':
-                for id in [s.labels['DomainName'] for s in self.parent.info_provider.get_metrics('cdn').samples]:
-                    metrics = self.query_cdn_domain_SBD_metrics(id)
-                    for metric in metrics:
-                        yield from self.parse_cdn_domain_SBD(id, metric)
-
-    def parse_cdn_domain_SBD(self, id, value: dict):
-        metric_name = 'DescribeDomainRealTimeSrcBpsData'
-        gauge = GaugeMetricFamily(
-            self.parent.format_metric_name(cdn_performance, metric_name),
-            '', labels=['cdnPerformance', 'instanceId'])
-        gauge.add_metric([metric_name, id], float(value['Value']))
-        yield gauge
-
-    def parse_cdn_domain_srccode(self, id, value: dict):
-        metrics: list = value['Value']['RealTimeSrcCodeProportionData']
-        if len(metrics) < 1:
+        start_time = time.time()
+        deadline = self.scrape_deadline()
+        # Submit every fetch up front, then yield in config order so the
+        # output stays deterministic regardless of completion order.
+        tasks = []
+        info_tasks = []
+        info_done = []
+        with self._config_lock:
+            for project in self.metrics:
+                if project in special_projects:
+                    continue
+                for metric in self.metrics[project]:
+                    # None for a region whose circuit is open
+                    tasks.append((project, metric, [(region, self.submit_fetch(project, metric, region)
+                                                     if self.allow_fetch(project, metric, region) else None)
+                                                    for region in self.region_ids]))
+            if self.info_metrics != None:
+                for resource in self.info_metrics:
+                    info_tasks.append((resource, [(region, self.pools[region].submit(self.info_providers[region].get_metrics,
+                                                                                     resource))
+                                                  for region in self.region_ids]))
+            special_collectors = list(self.special_collectors.values())
+        for _, fetches in info_tasks:
+            for _, task in fetches:
+                task.add_done_callback(lambda _: info_done.append(time.time()))
+
+        for project, metric, fetches in tasks:
+            results = []
+            for region, task in fetches:
+                if task is None:
+                    name = self.format_metric_name(project, metric.get('rename', metric.get('name')))
+                    results.append((region, [metric_up_gauge(name, False)]))
+                    continue
+                try:
+                    results.append((region, self.wait_fetch(task, deadline, project, metric, region)))
+                except TimeoutError:
+                    logging.error('Scrape deadline exceeded while querying {}_{} in {}'
+                                  .format(project, metric.get('name'), region))
+                    deadlineExceededCounter.labels(project).inc()
+                    name = self.format_metric_name(project, metric.get('rename', metric.get('name')))
+                    results.append((region, [metric_up_gauge(name, False)]))
+            yield from self.merge_regions(results)
+        scrapePhaseHistogram.labels('cloudmonitor').observe(time.time() - start_time)
+        for resource, fetches in info_tasks:
+            results = []
+            name = 'aliyun_meta_{}_info'.format(resource)
+            for region, task in fetches:
+                try:
+                    result = self.wait_results([task], deadline, name)[0]
+                except Exception as e:
+                    logging.error('Error fetching inventory in {}'.format(region), exc_info=e)
+                    results.append((region, [metric_up_gauge(name, False)]))
+                    continue
+                if result is timed_out:
+                    # Still crawling, the next scrape serves it once cached
+                    logging.error('Scrape deadline exceeded while fetching {} inventory in {}'.format(resource, region))
+                    results.append((region, [metric_up_gauge(name, False)]))
+                else:
+                    results.append((region, [result, metric_up_gauge(name, True)]))
+            yield from self.merge_regions(results)
+        if info_done:
+            scrapePhaseHistogram.labels('inventory').observe(max(info_done) - start_time)
+        if special_collectors:
+            special_start = time.time()
+            for v in special_collectors:
+                yield from v.collect(deadline)
+            scrapePhaseHistogram.labels('special').observe(time.time() - special_start)
+
+    '''
+    Merge the families fetched from each region into one family per name,
+    adding a region label to every sample when 'regions' is configured.
+    A merged family is reused while every region hands out the same family
+    as last time, so its rendered exposition text stays cached.
+    '''
+    def merge_regions(self, results):
+        if not self.regions:
+            for _, families in results:
+                yield from (f for f in families if f is not None)
             return
-        metric_name = 'DescribeDomainRealTimeSrcHttpCodeData'
-        for metric in metrics:
-            gauge = GaugeMetricFamily(
-                self.parent.format_metric_name(cdn_performance, metric_name),
-                '', labels=['cdnPerformance', 'instanceId', 'httpCode'])
-            gauge.add_metric([metric_name, id, metric['Code']], float(metric['Proportion']))
-            yield gauge
-
-    def parse_cdn_srccode(self, metric):
-        metric_name = 'DescribeDomainSrcHttpCodeData'
-
-        gauge = GaugeMetricFamily(
-            self.parent.format_metric_name(cdn_performance, metric_name),
-            '', labels=['cdnPerformance', 'httpCode'])
-        gauge.add_metric([metric_name, metric['Code']], float(metric['Proportion']))
-        yield gauge
-
-    def parse_cdn_SBD(self, metric):
-        metric_name = 'DescribeDomainSrcBpsData'
-
-        for k, v in metric.items():
-            if k == "TimeStamp":
+        grouped = dict()
+        for region, families in results:
+            for family in families:
+                if family is not None:
+                    grouped.setdefault(family.name, []).append((region, family))
+        for name, inputs in grouped.items():
+            cached = self.merged.get(name)
+            if cached is not None and len(cached[0]) == len(inputs) \
+                    and all(r == cr and f is cf for (r, f), (cr, cf) in zip(inputs, cached[0])):
+                yield cached[1]
                 continue
-            gauge = GaugeMetricFamily(
-                self.parent.format_metric_name(cdn_performance, metric_name),
-                '', labels=['cdnPerformance', 'type'])
-            gauge.add_metric([metric_name, k], float(v))
-            yield gauge
-
-    def query_cdn_domain_SBD_metrics(self, id):
-        req = DescribeDomainRealTimeSrcBpsDataRequest.DescribeDomainRealTimeSrcBpsDataRequest()
-        req.set_DomainName(id)
-        now = datetime.utcnow()
-        # now_str = now.replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        two_minute_ago_str = (now - timedelta(minutes=2)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        req.set_StartTime(two_minute_ago_str)
-        req.set_EndTime(one_minute_ago_str)
-        try:
-            resp = self.parent.client.do_action_with_exception(req)
-        except Exception as e:
-            logging.error('Error request rds performance api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        return data['RealTimeSrcBpsDataPerInterval']['DataModule']
-
-    def query_cdn_domain_srccode_metrics(self, id):
-        req = DescribeDomainRealTimeSrcHttpCodeDataRequest.DescribeDomainRealTimeSrcHttpCodeDataRequest()
-        req.set_DomainName(id)
-        now = datetime.utcnow()
-        # now_str = now.replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        two_minute_ago_str = (now - timedelta(minutes=2)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
-        req.set_StartTime(two_minute_ago_str)
-        req.set_EndTime(one_minute_ago_str)
-        try:
-            resp = self.parent.client.do_action_with_exception(req)
-        except Exception as e:
-            logging.error('Error request rds performance api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        return data['RealTimeSrcHttpCodeData']['UsageData']
-
-    def query_cdn_srccode_metrics(self,):
-        req = DescribeDomainSrcHttpCodeDataRequest.DescribeDomainSrcHttpCodeDataRequest()
-        now = time.time() - 300
-        start_time = datetime.utcfromtimestamp(now - 600).strftime("%Y-%m-%dT%H:%M:%SZ")
-        end_time = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%SZ")
-        req.set_accept_format('json')
-        req.set_StartTime(start_time)
-        req.set_EndTime(end_time)
-        try:
-            resp = self.parent.client.do_action_with_exception(req)
-        except Exception as e:
-            logging.error('Error request rds performance api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        return data['HttpCodeData']['UsageData'][0]['Value']['CodeProportionData']
-
-    def query_cdn_SBD_metric(self):
-        req = DescribeDomainSrcBpsDataRequest.DescribeDomainSrcBpsDataRequest()
-        now = time.time() - 300
-        start_time = datetime.utcfromtimestamp(now - 600).strftime("%Y-%m-%dT%H:%M:%SZ")
-        end_time = datetime.utcfromtimestamp(now).strftime("%Y-%m-%dT%H:%M:%SZ")
-        req.set_accept_format('json')
-        req.set_StartTime(start_time)
-        req.set_EndTime(end_time)
-        try:
-            resp = self.parent.client.do_action_with_exception(req)
-        except Exception as e:
-            logging.error('Error request rds performance api', exc_info=e)
-            return []
-        data = json.loads(resp)
-        return data['SrcBpsDataPerInterval']['DataModule'][0]
+            merged = Metric(name, inputs[0][1].documentation, inputs[0][1].type)
+            for region, family in inputs:
+                for sample in family.samples:
+                    merged.add_sample(sample.name, dict(sample.labels, region=region), sample.value,
+                                      sample.timestamp)
+            self.merged[name] = (inputs, merged)
+            yield merged
+
+
+'''
+Stable digest of a dimension filter, kept in the period cache key instead
+of the filter itself which can list thousands of instances.
+'''
+def dimensions_key(dimensions):
+    if dimensions is None:
+        return None
+    return hashlib.sha1(json.dumps(dimensions, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+'''
+A fetch succeeded when the aliyun_*_up gauge it ends with is 1.
+'''
+def fetch_succeeded(families):
+    return len(families) > 0 and families[-1].samples[0].value == 1.0
+
+
+'''
+Up gauges never change for a given resource and outcome, sharing them keeps
+their rendered exposition text cached.
+'''
+@lru_cache(maxsize=4096)
+def metric_up_gauge(resource: str, succeeded=True):
+    metric_name = resource + '_up'
+    description = 'Did the {} fetch succeed.'.format(resource)
+    return GaugeMetricFamily(metric_name, description, value=int(succeeded))
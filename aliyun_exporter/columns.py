@@ -0,0 +1,67 @@
+import sys
+
+from array import array
+from itertools import chain
+from operator import itemgetter
+
+# Datapoint fields holding values, every other field is a label
+value_fields = ('timestamp', 'Maximum', 'Minimum', 'Average', 'Sum')
+
+
+def intern_label(value) -> str:
+    return sys.intern(value if isinstance(value, str) else str(value))
+
+
+'''
+DatapointTable holds the datapoints of one CloudMonitor metric in columns.
+
+Label keys are stored once, the label values of every datapoint as a tuple
+of interned strings and the values as float arrays, one per value field.
+Rows equal to a row of the 'previous' table reuse its tuple, so the label
+sets of a metric are shared across scrapes instead of being rebuilt.
+'''
+class DatapointTable(object):
+
+    def __init__(self, label_keys=(), rows=None, values=None):
+        self.label_keys = label_keys
+        self.rows = rows if rows is not None else []
+        self.values = values if values is not None else {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_points(cls, points, previous=None):
+        points = iter(points)
+        first = next(points, None)
+        if first is None:
+            return cls()
+        label_keys = tuple(intern_label(k) for k in first if k not in value_fields)
+        known = {}
+        if previous is not None and previous.label_keys == label_keys:
+            label_keys = previous.label_keys
+            known = {row: row for row in previous.rows}
+        table = cls(label_keys, [], {k: array('d') for k in value_fields if k in first})
+        labels = itemgetter(*label_keys) if len(label_keys) > 1 else lambda point: (point[label_keys[0]],)
+        columns = list(table.values.items())
+        nan = float('nan')
+        for point in chain((first,), points):
+            try:
+                row = tuple(map(intern_label, labels(point))) if label_keys else ()
+            except KeyError:
+                row = tuple(intern_label(point[k]) if k in point else '' for k in label_keys)
+            table.rows.append(known.get(row, row))
+            for field, column in columns:
+                column.append(point.get(field, nan))
+        return table
+
+    def column(self, measure):
+        if measure in self.values:
+            return self.values[measure]
+        if measure in self.label_keys:
+            i = self.label_keys.index(measure)
+            return array('d', (float(row[i]) for row in self.rows))
+        raise KeyError(measure)
+
+    def latest_timestamp(self):
+        return max(self.values.get('timestamp') or [0])
@@ -0,0 +1,21 @@
+import pytest
+
+
+class FakeInventory(object):
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.calls = 0
+
+    def instance_ids(self, resource):
+        self.calls += 1
+        return self.ids
+
+
+'''
+Builds a stand-in for an InfoProvider serving the given instance ids and
+counting the lookups, for the special collectors.
+'''
+@pytest.fixture
+def fake_inventory():
+    return FakeInventory
@@ -0,0 +1,38 @@
+import threading
+import time
+
+_local = threading.local()
+
+'''
+Scrape deadline of the request being served by the current thread.
+
+Prometheus announces its scrape timeout in the
+X-Prometheus-Scrape-Timeout-Seconds header; the middleware turns it into an
+absolute deadline that collectors read with get_deadline() while the
+registry is collected on the same thread.
+'''
+
+
+def get_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+def set_deadline(deadline):
+    _local.deadline = deadline
+
+
+def deadline_middleware(app, offset=0.5):
+    def wrapped(environ, start_response):
+        timeout = environ.get('HTTP_X_PROMETHEUS_SCRAPE_TIMEOUT_SECONDS')
+        deadline = None
+        if timeout:
+            try:
+                deadline = time.time() + float(timeout) - offset
+            except ValueError:
+                deadline = None
+        set_deadline(deadline)
+        try:
+            return app(environ, start_response)
+        finally:
+            set_deadline(None)
+    return wrapped
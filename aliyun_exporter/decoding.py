@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+
+from importlib import import_module
+
+from prometheus_client import Gauge
+
+from aliyun_exporter.instrumentation import decodeHistogram
+
+decoderGauge = Gauge('aliyun_exporter_json_decoder', 'JSON decoder used for API responses', ['decoder'])
+
+# Preferred first
+decoders = ('orjson', 'ujson', 'json')
+
+'''
+JSON decoding of Aliyun API responses.
+
+Responses are decoded with orjson or ujson when one of them is installed,
+with the standard library otherwise. The ALIYUN_EXPORTER_JSON_DECODER
+environment variable picks a decoder explicitly.
+'''
+def select_decoder(name=None):
+    global loads, decoder
+    candidates = decoders if name is None else (name,)
+    for candidate in candidates:
+        try:
+            loads = import_module(candidate).loads
+        except ImportError:
+            logging.debug('JSON decoder {} is not installed'.format(candidate))
+            continue
+        decoderGauge.clear()
+        decoderGauge.labels(candidate).set(1)
+        decoder = candidate
+        return candidate
+    raise Exception('JSON decoder {} is not installed.'.format(name))
+
+
+loads = json.loads
+decoder = 'json'
+select_decoder(os.environ.get('ALIYUN_EXPORTER_JSON_DECODER'))
+
+
+'''
+Decode a QueryMetricLast response, whose Datapoints field is itself a JSON
+document. Returns the datapoints and the cursor of the next page, or
+(None, None) if the response has no Datapoints.
+'''
+def load_datapoints(resp):
+    with decodeHistogram.labels('QueryMetricLast').time():
+        data = loads(resp)
+        if 'Datapoints' not in data:
+            return None, None
+        return loads(data['Datapoints']), data.get('Cursor')
+
+
+def load_action(resp, action):
+    with decodeHistogram.labels(action).time():
+        return loads(resp)
@@ -0,0 +1,91 @@
+import gzip
+import threading
+
+from urllib.parse import parse_qs
+
+from prometheus_client import Counter, make_wsgi_app
+from prometheus_client.exposition import generate_latest
+
+from aliyun_exporter.instrumentation import scrapePhaseHistogram
+
+try:
+    from prometheus_client.exposition import CONTENT_TYPE_PLAIN_0_0_4 as CONTENT_TYPE
+except ImportError:
+    from prometheus_client.exposition import CONTENT_TYPE_LATEST as CONTENT_TYPE
+
+renderedCounter = Counter('aliyun_exporter_rendered_families',
+                          'Metric families rendered, by whether the cached exposition text was reused', ['cached'])
+
+
+class _Family(object):
+
+    def __init__(self, family):
+        self.family = family
+
+    def collect(self):
+        return [self.family]
+
+
+'''
+RenderCache keeps the exposition text of every metric family, plain and,
+once a scrape asked for it, gzip compressed, keyed by the family object
+itself.
+
+Collectors hand out the same family object for as long as its data does not
+change (inventory between refreshes, datapoints served from the period
+cache, polling snapshots), so a family seen again is served as the bytes
+rendered last time. Families missing from a scrape are dropped. The gzip
+blocks are complete gzip members; their concatenation is a valid gzip
+stream.
+'''
+class RenderCache(object):
+
+    def __init__(self):
+        # id(family) -> (family, plain text, gzip member or None)
+        self.blocks = dict()
+        self._lock = threading.Lock()
+
+    def render(self, families, compress=False) -> bytes:
+        seen = dict()
+        output = []
+        for family in families:
+            block = self.blocks.get(id(family))
+            if block is None or block[0] is not family:
+                block = (family, generate_latest(_Family(family)), None)
+                renderedCounter.labels('false').inc()
+            else:
+                renderedCounter.labels('true').inc()
+            if compress and block[2] is None:
+                # Compressed on first use only, most scrapers ask for one encoding
+                block = (family, block[1], gzip.compress(block[1]))
+            seen[id(family)] = block
+            output.append(block[2] if compress else block[1])
+        with self._lock:
+            self.blocks = seen
+        return b''.join(output)
+
+
+'''
+WSGI app serving a registry from a RenderCache. Requests the cache does not
+cover (OpenMetrics, name[] filters, methods other than GET) are handed to
+the prometheus_client app.
+'''
+def make_cached_wsgi_app(registry):
+    fallback = make_wsgi_app(registry)
+    cache = RenderCache()
+
+    def app(environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET' \
+                or 'openmetrics' in environ.get('HTTP_ACCEPT', '') \
+                or 'name[]' in parse_qs(environ.get('QUERY_STRING', '')):
+            return fallback(environ, start_response)
+        compress = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        families = list(registry.collect())
+        with scrapePhaseHistogram.labels('render').time():
+            output = cache.render(families, compress)
+        headers = [('Content-Type', CONTENT_TYPE)]
+        if compress:
+            headers.append(('Content-Encoding', 'gzip'))
+        start_response('200 OK', headers)
+        return [output]
+    return app
@@ -1,30 +1,97 @@
-import json
+import logging
 import time
 import datetime
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from aliyunsdkcore.client import AcsClient
-from cachetools import cached, TTLCache
+from prometheus_client import Counter, Gauge
 from prometheus_client.metrics_core import GaugeMetricFamily
 
-import aliyunsdkecs.request.v20140526.DescribeInstancesRequest as DescribeECS
-import aliyunsdkrds.request.v20140815.DescribeDBInstancesRequest as DescribeRDS
-import aliyunsdkr_kvstore.request.v20150101.DescribeInstancesRequest as DescribeRedis
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancersRequest as DescribeSLB
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancerAttributeRequest as DescribeSLBAttr
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancerTCPListenerAttributeRequest as DescribeSLBTcpAttr
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancerHTTPListenerAttributeRequest as DescribeSLBHttpAttr
-import aliyunsdkslb.request.v20140515.DescribeLoadBalancerHTTPSListenerAttributeRequest as DescribeSLBHttpsAttr
-import aliyunsdkdds.request.v20151201.DescribeDBInstancesRequest as Mongodb
-import aliyunsdkcdn.request.v20180510.DescribeUserDomainsRequest as DescribeCDN
-
+from aliyun_exporter import decoding
+from aliyun_exporter.cache import RefreshingCache
+from aliyun_exporter.columns import intern_label
+from aliyun_exporter.plugins import LazyRegistry
 from aliyun_exporter.utils import try_or_else
 
-cache = TTLCache(maxsize=100, ttl=3600)
+# Request of every inventory API, the product SDK is imported on first use
+inventory_requests = LazyRegistry('inventory request', {
+    'ecs': 'aliyunsdkecs.request.v20140526.DescribeInstancesRequest:DescribeInstancesRequest',
+    'rds': 'aliyunsdkrds.request.v20140815.DescribeDBInstancesRequest:DescribeDBInstancesRequest',
+    'redis': 'aliyunsdkr_kvstore.request.v20150101.DescribeInstancesRequest:DescribeInstancesRequest',
+    'slb': 'aliyunsdkslb.request.v20140515.DescribeLoadBalancersRequest:DescribeLoadBalancersRequest',
+    'slb_attribute': 'aliyunsdkslb.request.v20140515.DescribeLoadBalancerAttributeRequest:DescribeLoadBalancerAttributeRequest',
+    'slb_tcp_listener': 'aliyunsdkslb.request.v20140515.DescribeLoadBalancerTCPListenerAttributeRequest:'
+                        'DescribeLoadBalancerTCPListenerAttributeRequest',
+    'slb_http_listener': 'aliyunsdkslb.request.v20140515.DescribeLoadBalancerHTTPListenerAttributeRequest:'
+                         'DescribeLoadBalancerHTTPListenerAttributeRequest',
+    'slb_https_listener': 'aliyunsdkslb.request.v20140515.DescribeLoadBalancerHTTPSListenerAttributeRequest:'
+                          'DescribeLoadBalancerHTTPSListenerAttributeRequest',
+    'mongodb': 'aliyunsdkdds.request.v20151201.DescribeDBInstancesRequest:DescribeDBInstancesRequest',
+    'cdn': 'aliyunsdkcdn.request.v20180510.DescribeUserDomainsRequest:DescribeUserDomainsRequest',
+})
+
+refreshDurationGauge = Gauge('aliyun_exporter_inventory_refresh_duration_seconds',
+                             'Duration of the last inventory refresh', ['resource', 'region'])
+refreshFailedCounter = Counter('aliyun_exporter_inventory_refresh_failures',
+                               'Failed inventory refreshes', ['resource', 'region'])
+inventoryAgeGauge = Gauge('aliyun_exporter_inventory_age_seconds',
+                          'Age of the served inventory', ['resource', 'region'])
+droppedSeriesCounter = Counter('aliyun_exporter_inventory_dropped_series',
+                               'Inventory series dropped for exceeding the series budget of their family', ['resource'])
+
+# Resource -> label identifying an instance, always kept under its name
+id_labels = {
+    'ecs': 'InstanceId',
+    'rds': 'DBInstanceId',
+    'redis': 'InstanceId',
+    'slb': 'LoadBalancerId',
+    'mongodb': 'DBInstanceId',
+    'cdn': 'DomainName',
+}
+
+
+# The exposed info family of a resource and the ids of all its instances
+Inventory = namedtuple('Inventory', ['family', 'ids'])
+
+
+'''
+LabelFilter selects and renames the labels of an aliyun_meta_*_info family.
+
+'allow' keeps only the listed attributes, 'deny' drops the listed ones and
+'rename' maps attribute names to label names. The id label of a resource
+is always kept so dimensions_from and the special collectors can find the
+instances. 'max_series' caps the series of the family, instances past the
+budget are counted and skipped before their label values are built. The
+budget only applies to the exposed family: dimensions_from, the special
+collectors and the SLB listener crawl still see every instance id.
+'''
+class LabelFilter(object):
+
+    def __init__(self, resource, allow=None, deny=None, rename=None, max_series=None):
+        if resource not in id_labels:
+            raise Exception('info_labels resource must be one of {}.'.format(', '.join(id_labels)))
+        self.resource = resource
+        self.id_label = id_labels[resource]
+        if self.id_label in (deny or []) or self.id_label in (rename or {}):
+            raise Exception('{} identifies {} instances and cannot be denied or renamed.'.format(self.id_label, resource))
+        self.allow = None if allow is None else set(allow) | {self.id_label}
+        self.deny = set(deny or [])
+        self.rename = dict(rename or {})
+        self.max_series = max_series
+
+    def keys(self, keys):
+        return [k for k in keys if (self.allow is None or k in self.allow) and k not in self.deny]
+
+    def names(self, keys):
+        return [self.rename.get(k, k) for k in keys]
 
 '''
 InfoProvider provides the information of cloud resources as metric.
 
-The result from alibaba cloud API will be cached for an hour. 
+The result from alibaba cloud API will be cached, by default for an hour.
+Expired results are refreshed in the background while the last good result
+keeps being served.
 
 Different resources should implement its own 'xxx_info' function. 
 
@@ -35,80 +102,156 @@ attribute is not handled explicitly, it will be dropped.
 '''
 class InfoProvider():
 
-    def __init__(self, client: AcsClient):
+    def __init__(self, client: AcsClient, ttl=3600, pool_size=10, info_labels=None, region=''):
         self.client = client
+        self.region = region
+        self.label_filters = {resource: LabelFilter(resource, **(options or {}))
+                              for resource, options in (info_labels or {}).items()}
+        self.pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='inventory')
+        # LoadBalancerId -> (listener ports and protocols, [(protocol, port, bandwidth)])
+        self.slb_bandwidths = {}
+        self.cache = RefreshingCache(ttl, on_refresh=self.on_refresh)
 
-    @cached(cache)
-    def get_metrics(self, resource: str) -> GaugeMetricFamily:
-        return {
+    def inventory(self, resource: str) -> Inventory:
+        loader = {
             'ecs': lambda : self.ecs_info(),
             'rds': lambda : self.rds_info(),
             'cdn': lambda : self.cdn_info(),
             'redis': lambda : self.redis_info(),
             'slb':lambda : self.slb_info(),
             'mongodb':lambda : self.mongodb_info(),
-        }[resource]()
+        }[resource]
+        return self.cache.get(resource, loader)
 
-    def ecs_info(self) -> GaugeMetricFamily:
-        req = DescribeECS.DescribeInstancesRequest()
+    def get_metrics(self, resource: str) -> GaugeMetricFamily:
+        return self.inventory(resource).family
+
+    '''
+    Ids of every instance of a resource, including those left out of the
+    info family by its 'max_series' budget.
+    '''
+    def instance_ids(self, resource: str):
+        return self.inventory(resource).ids
+
+    def dump(self):
+        return self.cache.dump()
+
+    def restore(self, entries):
+        self.cache.restore(entries)
+        for resource in entries:
+            inventoryAgeGauge.labels(resource, self.region).set_function(lambda resource=resource: self.cache.age(resource))
+
+    def on_refresh(self, resource, duration, succeeded):
+        if not succeeded:
+            refreshFailedCounter.labels(resource, self.region).inc()
+            return
+        refreshDurationGauge.labels(resource, self.region).set(duration)
+        inventoryAgeGauge.labels(resource, self.region).set_function(lambda: self.cache.age(resource))
+
+    def ecs_info(self) -> Inventory:
+        req = inventory_requests.get('ecs')()
         nested_handler = {
             'InnerIpAddress': lambda obj : try_or_else(lambda : obj['IpAddress'][0], ''),
             'PublicIpAddress': lambda obj : try_or_else(lambda : obj['IpAddress'][0], ''),
             'VpcAttributes': lambda obj : try_or_else(lambda : obj['PrivateIpAddress']['IpAddress'][0], ''),
         }
-        return self.info_template(req, 'aliyun_meta_ecs_info', nested_handler=nested_handler)
+        return self.info_template(req, 'aliyun_meta_ecs_info', nested_handler=nested_handler, resource='ecs')
 
-    def rds_info(self) -> GaugeMetricFamily:
-        req = DescribeRDS.DescribeDBInstancesRequest()
-        return self.info_template(req, 'aliyun_meta_rds_info', to_list=lambda data: data['Items']['DBInstance'])
+    def rds_info(self) -> Inventory:
+        req = inventory_requests.get('rds')()
+        return self.info_template(req, 'aliyun_meta_rds_info', resource='rds',
+                                  to_list=lambda data: data['Items']['DBInstance'])
 
-    def redis_info(self) -> GaugeMetricFamily:
-        req = DescribeRedis.DescribeInstancesRequest()
-        return self.info_template(req, 'aliyun_meta_redis_info', to_list=lambda data: data['Instances']['KVStoreInstance'])
+    def redis_info(self) -> Inventory:
+        req = inventory_requests.get('redis')()
+        return self.info_template(req, 'aliyun_meta_redis_info', resource='redis',
+                                  to_list=lambda data: data['Instances']['KVStoreInstance'])
+
+    '''
+    The listener bandwidths are crawled for every load balancer, including
+    those left out of aliyun_meta_slb_info by its 'max_series' budget.
+    '''
+    def slb_info(self) -> Inventory:
+        req = inventory_requests.get('slb')()
+        slb_ids = self.info_template(req, 'aliyun_meta_slb_info', resource='slb',
+                                     to_list=lambda data: data['LoadBalancers']['LoadBalancer']).ids
+        listeners = dict()
+        for slb_id, task in zip(slb_ids, [self.pool.submit(self.slb_listeners, slb_id) for slb_id in slb_ids]):
+            try:
+                listeners[slb_id] = task.result()
+            except Exception as e:
+                logging.error('Error fetching the listeners of {}, keep its last bandwidths'.format(slb_id), exc_info=e)
+
+        # Only re-query the listener attributes of load balancers whose
+        # listener set changed since the last crawl. A load balancer that
+        # fails keeps its last entry, which is retried on the next crawl.
+        bandwidths = {slb_id: self.slb_bandwidths[slb_id] for slb_id in slb_ids if slb_id in self.slb_bandwidths
+                      and (slb_id not in listeners or self.slb_bandwidths[slb_id][0] == listeners[slb_id])}
+        jobs = [(slb_id, protocol, port) for slb_id in slb_ids if slb_id in listeners and slb_id not in bandwidths
+                for protocol, port in listeners[slb_id]]
+        changed = {slb_id: (listeners[slb_id], []) for slb_id, _, _ in jobs}
+        tasks = [self.pool.submit(self.slb_listener_bandwidth, *job) for job in jobs]
+        for (slb_id, protocol, port), task in zip(jobs, tasks):
+            try:
+                bandwidth = task.result()
+            except Exception as e:
+                logging.error('Error fetching the {} listener {} of {}'.format(protocol, port, slb_id), exc_info=e)
+                changed.pop(slb_id, None)
+                if slb_id in self.slb_bandwidths:
+                    bandwidths[slb_id] = self.slb_bandwidths[slb_id]
+                continue
+            if bandwidth is not None and slb_id in changed:
+                changed[slb_id][1].append((protocol, port, bandwidth))
+        bandwidths.update(changed)
+        self.slb_bandwidths = bandwidths
 
-    def slb_info(self) -> GaugeMetricFamily:
-        req = DescribeSLB.DescribeLoadBalancersRequest()
-        gauge = self.info_template(req, 'aliyun_meta_slb_info', to_list=lambda data: data['LoadBalancers']['LoadBalancer'])
         gauge_slb_info = None
-        for s in gauge.samples:
-            slb_id = s.labels['LoadBalancerId']
-            req_slb_attr = DescribeSLBAttr.DescribeLoadBalancerAttributeRequest()
-            req_slb_attr.set_LoadBalancerId(slb_id)
-            slb_attrs_resp = self.client.do_action_with_exception(req_slb_attr)
-            slb_attrs_info = json.loads(slb_attrs_resp)
-            for protocol_info in slb_attrs_info['ListenerPortsAndProtocol']['ListenerPortAndProtocol']:
-                protocol = protocol_info['ListenerProtocol']
-                port = protocol_info['ListenerPort']
-                req_slb_proto = None
-                if protocol == 'tcp':
-                    req_slb_proto = DescribeSLBTcpAttr.DescribeLoadBalancerTCPListenerAttributeRequest()
-                elif protocol == 'http':
-                    req_slb_proto = DescribeSLBHttpAttr.DescribeLoadBalancerHTTPListenerAttributeRequest()
-                elif protocol == 'https':
-                    req_slb_proto = DescribeSLBHttpsAttr.DescribeLoadBalancerHTTPSListenerAttributeRequest()
-                req_slb_proto.set_LoadBalancerId(slb_id)
-                req_slb_proto.set_ListenerPort(int(port))
-                slb_protocol_resp = self.client.do_action_with_exception(req_slb_proto)
-                slb_protocol_info: dict = json.loads(slb_protocol_resp)
-                if 'ForwardCode' in slb_protocol_info.keys():
-                    continue
-                Bandwidth = slb_protocol_info['Bandwidth']
+        for slb_id in slb_ids:
+            for protocol, port, bandwidth in bandwidths.get(slb_id, (None, []))[1]:
                 if gauge_slb_info is None:
-                    gauge_slb_info = GaugeMetricFamily('aliyun_meta_slb_proto_bandwidth', 'protocolBandwidth', labels=['instanceId', 'ListenerProtocol', 'ListenerPort'])
-                gauge_slb_info.add_metric([slb_id, protocol, str(port)], value=float(Bandwidth))
-        return gauge_slb_info
+                    gauge_slb_info = GaugeMetricFamily('aliyun_meta_slb_proto_bandwidth', 'protocolBandwidth',
+                                                       labels=['instanceId', 'ListenerProtocol', 'ListenerPort'])
+                gauge_slb_info.add_metric([slb_id, protocol, str(port)], value=float(bandwidth))
+        return Inventory(gauge_slb_info, slb_ids)
 
-    def mongodb_info(self) -> GaugeMetricFamily:
-        req = Mongodb.DescribeDBInstancesRequest()
-        return self.info_template(req, 'aliyun_meta_mongodb_info', to_list=lambda data: data['DBInstances']['DBInstance'])
+    def slb_listeners(self, slb_id):
+        req_slb_attr = inventory_requests.get('slb_attribute')()
+        req_slb_attr.set_LoadBalancerId(slb_id)
+        slb_attrs_resp = self.client.do_action_with_exception(req_slb_attr)
+        slb_attrs_info = decoding.load_action(slb_attrs_resp, req_slb_attr.get_action_name())
+        return tuple(sorted((protocol_info['ListenerProtocol'], protocol_info['ListenerPort'])
+                            for protocol_info in slb_attrs_info['ListenerPortsAndProtocol']['ListenerPortAndProtocol']))
 
-    def cdn_info(self) -> GaugeMetricFamily:
-        req = DescribeCDN.DescribeUserDomainsRequest()
+    def slb_listener_bandwidth(self, slb_id, protocol, port):
+        if protocol == 'tcp':
+            req_slb_proto = inventory_requests.get('slb_tcp_listener')()
+        elif protocol == 'http':
+            req_slb_proto = inventory_requests.get('slb_http_listener')()
+        elif protocol == 'https':
+            req_slb_proto = inventory_requests.get('slb_https_listener')()
+        else:
+            return None
+        req_slb_proto.set_LoadBalancerId(slb_id)
+        req_slb_proto.set_ListenerPort(int(port))
+        slb_protocol_resp = self.client.do_action_with_exception(req_slb_proto)
+        slb_protocol_info: dict = decoding.load_action(slb_protocol_resp, req_slb_proto.get_action_name())
+        if 'ForwardCode' in slb_protocol_info.keys():
+            return None
+        return slb_protocol_info['Bandwidth']
+
+    def mongodb_info(self) -> Inventory:
+        req = inventory_requests.get('mongodb')()
+        return self.info_template(req, 'aliyun_meta_mongodb_info', resource='mongodb',
+                                  to_list=lambda data: data['DBInstances']['DBInstance'])
+
+    def cdn_info(self) -> Inventory:
+        req = inventory_requests.get('cdn')()
         req.set_DomainStatus('online')
         nested_handler = {
             'DomainName': lambda obj: try_or_else(lambda: obj['DomainName'], ''),
         }
-        return self.info_template(req, 'aliyun_meta_cdn_info', to_list=lambda data: data['Domains']['PageData'])
+        return self.info_template(req, 'aliyun_meta_cdn_info', resource='cdn',
+                                  to_list=lambda data: data['Domains']['PageData'])
 
     '''
     Template method to retrieve resource information and transform to metric.
@@ -120,15 +263,32 @@ class InfoProvider():
                       page_size=100,
                       page_num=1,
                       nested_handler=None,
-                      to_list=(lambda data: data['Instances']['Instance'])) -> GaugeMetricFamily:
+                      to_list=(lambda data: data['Instances']['Instance']),
+                      resource=None) -> Inventory:
         gauge = None
         label_keys = None
+        label_filter = self.label_filters.get(resource)
+        max_series = None if label_filter is None else label_filter.max_series
+        id_label = id_labels.get(resource)
+        ids = []
+        dropped = 0
         for instance in self.pager_generator(req, page_size, page_num, to_list):
+            if id_label is not None:
+                ids.append(intern_label(instance.get(id_label, '')))
             if gauge is None:
                 label_keys = self.label_keys(instance, nested_handler)
-                gauge = GaugeMetricFamily(name, desc, labels=label_keys)
+                label_names = label_keys
+                if label_filter is not None:
+                    label_keys = label_filter.keys(label_keys)
+                    label_names = label_filter.names(label_keys)
+                gauge = GaugeMetricFamily(name, desc, labels=label_names)
+            if max_series is not None and len(gauge.samples) >= max_series:
+                dropped += 1
+                continue
             gauge.add_metric(labels=self.label_values(instance, label_keys, nested_handler), value=1.0)
-        return gauge
+        if dropped:
+            droppedSeriesCounter.labels(resource).inc(dropped)
+        return Inventory(gauge, ids)
 
     def info_template_bytime(self,
                       req,
@@ -148,10 +308,10 @@ class InfoProvider():
         while True:
             req.set_PageNumber(page_num)
             resp = self.client.do_action_with_exception(req)
-            data = json.loads(resp)
+            data = decoding.load_action(resp, req.get_action_name())
             instances = to_list(data)
             for instance in instances:
-                if 'test' not in instance.get('DomainName'):
+                if 'test' not in instance.get('DomainName', ''):
                     yield instance
             if len(instances) < page_size:
                 break
@@ -177,7 +337,14 @@ class InfoProvider():
     def label_values(self, instance, label_keys, nested_handler=None):
         if nested_handler is None:
             nested_handler = {}
-        return map(lambda k: str(nested_handler[k](instance[k])) if k in nested_handler else try_or_else(lambda: str(instance[k]), ''),
-                   label_keys)
+        values = []
+        for k in label_keys:
+            if k not in instance:
+                values.append('')
+            elif k in nested_handler:
+                values.append(intern_label(nested_handler[k](instance[k])))
+            else:
+                values.append(intern_label(instance[k]))
+        return values
 
 
@@ -0,0 +1,22 @@
+from prometheus_client import Gauge, Histogram
+
+'''
+Hot-path instrumentation shared by the API client, the decoders, the
+collector and the /metrics app.
+
+A request's time is split into waiting for the rate limiter, the API call
+itself (signing, network and server time) and decoding the response. A
+scrape is split into phases: 'cloudmonitor' and 'inventory' run
+concurrently and end when their last fetch completes, 'special' covers
+the special projects and 'render' the exposition output.
+'''
+apiRequestHistogram = Histogram('aliyun_exporter_api_request_duration_seconds',
+                                'Duration of Aliyun API calls',
+                                ['product', 'action', 'project', 'metric', 'outcome'])
+apiInflightGauge = Gauge('aliyun_exporter_api_requests_in_flight', 'Aliyun API calls in flight', ['product'])
+rateLimitWaitHistogram = Histogram('aliyun_exporter_ratelimit_wait_seconds',
+                                   'Time spent waiting for the rate limiter', ['product'])
+decodeHistogram = Histogram('aliyun_exporter_api_decode_duration_seconds',
+                            'Time spent decoding API responses', ['action'])
+scrapePhaseHistogram = Histogram('aliyun_exporter_scrape_phase_duration_seconds',
+                                 'Duration of the phases of a scrape', ['phase'])
@@ -0,0 +1,104 @@
+import logging
+import threading
+
+from aliyun_exporter import decoding
+from aliyun_exporter.cache import RefreshingCache
+from aliyun_exporter.QueryMetricMetaRequest import QueryMetricMetaRequest
+from aliyun_exporter.QueryProjectMetaRequest import QueryProjectMetaRequest
+
+'''
+MetadataIndex keeps the CloudMonitor project and metric definitions shown by
+the web UI in memory.
+
+Every list is fetched page by page until the last page, so large projects
+are complete. A background crawl reloads the project list and the metrics
+of every listed project every 'ttl' seconds; pages are served from memory,
+and the metrics of a project that disappears from the list expire after
+two crawls. The client is expected to be rate limited on its own bucket
+(see SharedResources.metadata_client), so a crawl never competes with
+scrapes.
+'''
+class MetadataIndex(object):
+
+    def __init__(self, client, ttl=3600, page_size=100):
+        self.client = client
+        self.ttl = ttl
+        self.page_size = page_size
+        self.cache = RefreshingCache(ttl, expire_after=2 * ttl, max_entries=4096)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='metadata-crawler', daemon=True)
+        self._start_lock = threading.Lock()
+
+    '''
+    Start the background crawl, the web UI does so on its first page view so
+    an exporter nobody browses makes no metadata calls.
+    '''
+    def start(self):
+        with self._start_lock:
+            if not self._thread.is_alive() and not self._stop.is_set():
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while True:
+            self.crawl()
+            if self._stop.wait(self.ttl):
+                return
+
+    def crawl(self):
+        entry = self.cache.load('projects', self.load_projects)
+        if entry is None:
+            return
+        for project in entry[0]:
+            if self._stop.is_set():
+                return
+            name = project['Project']
+            self.cache.load(('metrics', name), lambda: self.load_metrics(name))
+
+    def projects(self):
+        return self.cache.get('projects', self.load_projects)
+
+    def metrics(self, project):
+        return self.cache.get(('metrics', project), lambda: self.load_metrics(project))
+
+    '''
+    Search project and metric names and descriptions in what is already
+    indexed, without calling the API.
+    '''
+    def search(self, query):
+        query = query.lower()
+        results = []
+        for project in self.cache.peek('projects') or []:
+            name = project['Project']
+            project_matches = query in name.lower() or query in (project.get('Description') or '').lower()
+            for metric in self.cache.peek(('metrics', name)) or []:
+                if project_matches or query in metric['Metric'].lower() \
+                        or query in (metric.get('Description') or '').lower():
+                    results.append((name, metric))
+        return results
+
+    def load_projects(self):
+        return self.load_pages(QueryProjectMetaRequest())
+
+    def load_metrics(self, project):
+        req = QueryMetricMetaRequest()
+        req.set_Project(project)
+        return self.load_pages(req)
+
+    def load_pages(self, req):
+        items = []
+        page_num = 1
+        req.set_PageSize(self.page_size)
+        while True:
+            req.set_PageNumber(page_num)
+            resp = self.client.do_action_with_exception(req)
+            data = decoding.load_action(resp, req.get_action_name())
+            page = data['Resources']['Resource']
+            items.extend(page)
+            if len(page) < self.page_size:
+                logging.debug('Indexed {} items of {}'.format(len(items), req.get_action_name()))
+                return items
+            page_num += 1
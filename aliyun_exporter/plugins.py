@@ -0,0 +1,48 @@
+import threading
+import time
+
+from importlib import import_module
+
+from prometheus_client import Gauge
+
+pluginLoadGauge = Gauge('aliyun_exporter_plugin_load_seconds', 'Time spent importing a plugin', ['registry', 'name'])
+
+'''
+LazyRegistry maps names to 'module:attribute' references and imports a
+reference the first time its name is looked up.
+
+Special projects and inventory resources are registered this way, so the
+SDK of a product is only imported when a config actually uses it. More
+plugins can be added with register() before the collectors are built.
+'''
+class LazyRegistry(object):
+
+    def __init__(self, kind, entries=None):
+        self.kind = kind
+        self.entries = dict(entries or {})
+        self.loaded = dict()
+        self._lock = threading.Lock()
+
+    def register(self, name, reference):
+        with self._lock:
+            self.entries[name] = reference
+            self.loaded.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def get(self, name):
+        if name in self.loaded:
+            return self.loaded[name]
+        if name not in self.entries:
+            raise Exception('Unknown {} {}, must be one of {}.'.format(self.kind, name, ', '.join(self.entries)))
+        with self._lock:
+            if name not in self.loaded:
+                start_time = time.time()
+                module, _, attribute = self.entries[name].partition(':')
+                self.loaded[name] = getattr(import_module(module), attribute)
+                pluginLoadGauge.labels(self.kind, name).set(time.time() - start_time)
+            return self.loaded[name]
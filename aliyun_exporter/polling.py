@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+
+from collections import namedtuple
+from prometheus_client import Summary
+from prometheus_client.core import GaugeMetricFamily
+
+pollSummary = Summary('aliyun_exporter_poll_duration_seconds', 'Duration of a background collection')
+
+Snapshot = namedtuple('Snapshot', ['families', 'timestamp'])
+
+'''
+PollingCollector serves a collector's output from an in-memory snapshot.
+
+A background thread runs the delegate's collect() every 'interval' seconds
+and swaps in a new immutable snapshot, so a scrape never waits on the
+Aliyun APIs. If a refresh fails the previous snapshot keeps being served,
+and the age/stale gauges tell Prometheus how old it is.
+'''
+class PollingCollector(object):
+
+    def __init__(self, delegate, interval: float):
+        self.delegate = delegate
+        self.interval = interval
+        self.snapshot = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='snapshot-poller', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            self.refresh()
+            self._stop.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def refresh(self):
+        start_time = time.time()
+        try:
+            families = tuple(self.delegate.collect())
+        except Exception as e:
+            logging.error('Error refreshing metric snapshot, keep serving the previous one', exc_info=e)
+            return
+        self.snapshot = Snapshot(families, time.time())
+        pollSummary.observe(time.time() - start_time)
+
+    def dump(self):
+        return self.snapshot
+
+    def restore(self, snapshot):
+        if self.snapshot is None:
+            self.snapshot = snapshot
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        snapshot = self.snapshot
+        if snapshot is not None:
+            yield from snapshot.families
+            age = time.time() - snapshot.timestamp
+        else:
+            age = float('inf')
+        yield GaugeMetricFamily('aliyun_exporter_snapshot_age_seconds',
+                                'Seconds since the served metric snapshot was collected',
+                                value=age)
+        yield GaugeMetricFamily('aliyun_exporter_snapshot_stale',
+                                'Whether the served metric snapshot missed its last two refreshes',
+                                value=int(age > 2 * self.interval))
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from prometheus_client import Counter, Gauge
+
+from aliyun_exporter.instrumentation import apiInflightGauge, apiRequestHistogram, rateLimitWaitHistogram
+
+tokensGauge = Gauge('aliyun_exporter_ratelimit_tokens', 'Tokens available in the rate limiter of an API product', ['product'])
+rateGauge = Gauge('aliyun_exporter_ratelimit_rate', 'Current request rate allowed for an API product', ['product'])
+throttledCounter = Counter('aliyun_exporter_api_throttled', 'Requests rejected by Aliyun with a Throttling error', ['product'])
+
+'''
+TokenBucket allows 'rate' requests per second with bursts of up to 'rate'
+requests.
+
+A throttled response halves the allowed rate, every successful response
+recovers it by a small step until the configured rate is reached again.
+Callers reserve a token before waiting for it, so waiters are served in
+order and the lock is never held while sleeping.
+'''
+class TokenBucket(object):
+
+    def __init__(self, rate: float, decrease=0.5, recovery=0.05):
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate * recovery
+        self.rate = self.max_rate
+        self.decrease = decrease
+        self.recovery = recovery
+        self.tokens = self.max_rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _fill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        with self._lock:
+            self._fill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def available(self):
+        with self._lock:
+            self._fill()
+            return max(self.tokens, 0)
+
+    def throttled(self):
+        with self._lock:
+            self._fill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._fill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery)
+
+
+# Buckets with their own default rate, not taken from 'default'
+default_limits = {
+    # CloudMonitor metadata calls of the web UI, kept off the scrape budget
+    'cms-meta': 1,
+}
+
+'''
+RateLimiters holds one TokenBucket per API product (cms, rds, cdn, slb, ecs...).
+
+'rate_limit' is either a number applied to every product, or a dict of
+product -> requests per second with an optional 'default' entry for the
+products not listed.
+'''
+class RateLimiters(object):
+
+    def __init__(self, rate_limit=10):
+        if isinstance(rate_limit, dict):
+            self.limits = {k.lower(): v for k, v in rate_limit.items()}
+        else:
+            self.limits = {'default': rate_limit}
+        self.buckets = dict()
+        self._lock = threading.Lock()
+
+    def get(self, product: str) -> TokenBucket:
+        product = (product or 'default').lower()
+        bucket = self.buckets.get(product)
+        if bucket is not None:
+            return bucket
+        with self._lock:
+            if product not in self.buckets:
+                default = default_limits.get(product, self.limits.get('default', 10))
+                bucket = TokenBucket(self.limits.get(product, default))
+                tokensGauge.labels(product).set_function(bucket.available)
+                rateGauge.labels(product).set_function(lambda: bucket.rate)
+                self.buckets[product] = bucket
+            return self.buckets[product]
+
+
+def is_throttling(e: Exception):
+    return isinstance(e, ServerException) and e.get_error_code() is not None \
+        and e.get_error_code().startswith('Throttling')
+
+
+'''
+RateLimitedClient puts every request of an AcsClient behind the token bucket
+of its API product, or of 'product' when given, and feeds the Throttling
+responses back to the bucket. Every request passes through here, so this is
+also where the API calls are timed.
+'''
+class RateLimitedClient(object):
+
+    def __init__(self, client, limiters: RateLimiters, product: str = None):
+        self.client = client
+        self.limiters = limiters
+        self.product = product
+
+    def do_action_with_exception(self, req):
+        product = (self.product or req.get_product() or 'default').lower()
+        params = req.get_query_params() or {}
+        labels = (product, req.get_action_name() or '', params.get('Project', ''), params.get('Metric', ''))
+        bucket = self.limiters.get(product)
+        with rateLimitWaitHistogram.labels(product).time():
+            bucket.acquire()
+        start_time = time.time()
+        try:
+            with apiInflightGauge.labels(product).track_inprogress():
+                resp = self.client.do_action_with_exception(req)
+        except Exception as e:
+            outcome = 'error'
+            if is_throttling(e):
+                outcome = 'throttled'
+                throttledCounter.labels(product).inc()
+                bucket.throttled()
+            apiRequestHistogram.labels(*labels, outcome).observe(time.time() - start_time)
+            raise
+        apiRequestHistogram.labels(*labels, 'success').observe(time.time() - start_time)
+        bucket.succeeded()
+        return resp
+
+    def __getattr__(self, item):
+        return getattr(self.client, item)
@@ -0,0 +1,88 @@
+import logging
+
+from datetime import datetime, timedelta
+from prometheus_client.core import GaugeMetricFamily
+from aliyunsdkrds.request.v20140815 import DescribeDBInstancePerformanceRequest
+
+from aliyun_exporter import decoding
+from aliyun_exporter.collector import AliyunCollector, metric_up_gauge, rds_performance, timed_out
+
+
+class RDSPerformanceCollector:
+
+    def __init__(self, delegate: AliyunCollector):
+        self.parent = delegate
+        # DBInstanceId -> (window, performance keys) of the last successful query
+        self.windows = dict()
+
+    '''
+    Instances whose query is not done by the scrape deadline are left out,
+    aliyun_rds_performance_up is 0 then.
+    '''
+    def collect(self, deadline=None):
+        ids = self.parent.wait_results([self.parent.pool.submit(self.parent.info_provider.instance_ids, 'rds')],
+                                       deadline, rds_performance)[0]
+        if ids is timed_out:
+            logging.error('Scrape deadline exceeded while fetching the rds inventory')
+            yield metric_up_gauge('aliyun_' + rds_performance, False)
+            return
+        window = self.query_window()
+        tasks = [self.parent.pool.submit(self.cached_rds_performance_metrics, id, window) for id in ids]
+        results = self.parent.wait_results(tasks, deadline, rds_performance)
+        for id, metrics in zip(ids, results):
+            if metrics is timed_out:
+                continue
+            for metric in metrics:
+                yield from self.parse_rds_performance(id, metric)
+        self.windows = {id: self.windows[id] for id in ids if id in self.windows}
+        yield metric_up_gauge('aliyun_' + rds_performance, timed_out not in results)
+
+    def query_window(self):
+        now = datetime.utcnow()
+        now_str = now.replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
+        one_minute_ago_str = (now - timedelta(minutes=1)).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%MZ")
+        return one_minute_ago_str, now_str
+
+    '''
+    Performance data only changes when the one-minute window moves, so scrapes
+    within the same minute reuse the last response of an instance.
+    '''
+    def cached_rds_performance_metrics(self, id, window):
+        cached = self.windows.get(id)
+        if cached is not None and cached[0] == window:
+            return cached[1]
+        metrics = self.query_rds_performance_metrics(id, window)
+        if len(metrics) > 0:
+            self.windows[id] = (window, metrics)
+        return metrics
+
+    def parse_rds_performance(self, id, value):
+        value_format: str = value['ValueFormat']
+        metric_name = value['Key']
+        keys = ['value']
+        if value_format is not None and '&' in value_format:
+            keys = value_format.split('&')
+        metric = value['Values']['PerformanceValue']
+        if len(metric) < 1:
+            return
+        values = metric[0]['Value'].split('&')
+        for k, v in zip(keys, values):
+            gauge = GaugeMetricFamily(
+                self.parent.format_metric_name(rds_performance, metric_name + '_' + k),
+                '', labels=['instanceId'])
+            gauge.add_metric([id], float(v))
+            yield gauge
+
+    def query_rds_performance_metrics(self, id, window):
+        req = DescribeDBInstancePerformanceRequest.DescribeDBInstancePerformanceRequest()
+        req.set_DBInstanceId(id)
+        req.set_Key(','.join([metric['name'] for metric in self.parent.metrics[rds_performance]]))
+        req.set_StartTime(window[0])
+        req.set_EndTime(window[1])
+        try:
+            resp = self.parent.client.do_action_with_exception(req)
+        except Exception as e:
+            logging.error('Error request rds performance api', exc_info=e)
+            return []
+        data = decoding.load_action(resp, req.get_action_name())
+        return data['PerformanceKeys']['PerformanceKey']
@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from prometheus_client import Counter, Gauge
+
+from aliyun_exporter.coalesce import CoalescingCollector
+from aliyun_exporter.collector import CollectorConfig
+from aliyun_exporter.polling import PollingCollector
+
+configReloadCounter = Counter('aliyun_exporter_config_reloads', 'Config file reloads', ['module', 'outcome'])
+configReloadTimeGauge = Gauge('aliyun_exporter_config_last_reload_timestamp_seconds',
+                              'Time of the last successful config reload', ['module'])
+
+# Options taken once per process, a change only applies after a restart
+restart_options = ('rate_limit', 'connection_pool_size', 'inventory_ttl', 'info_labels', 'state_file',
+                   'state_interval', 'metadata_ttl', 'scrape_timeout_offset')
+
+
+def load_config(path: str) -> CollectorConfig:
+    with open(path, 'r') as config_file:
+        cfg = yaml.load(config_file, Loader=yaml.FullLoader)
+    return CollectorConfig(**cfg)
+
+
+class _Module(object):
+
+    def __init__(self, name, path, config, collector, wrapper, registry):
+        self.name = name
+        self.path = path
+        self.config = config
+        self.collector = collector
+        self.wrapper = wrapper
+        self.registry = registry
+        self.mtime = self.modified()
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+
+'''
+ConfigReloader re-reads the config files of the served modules on SIGHUP,
+and every 'watch_interval' seconds when their modification time changed.
+
+A reloaded config is compared with the one in use and, if it differs,
+applied to the running collector with AliyunCollector.reconfigure(), so
+the inventory cache, rate limiters, connections and the cached datapoints
+of unchanged metrics survive the reload. A config that fails to load or
+apply is logged and the previous one keeps being served.
+'''
+class ConfigReloader(object):
+
+    def __init__(self, shared, state=None, watch_interval: float = None):
+        self.shared = shared
+        self.state = state
+        self.watch_interval = watch_interval
+        self.modules = dict()
+        self._reload = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='config-reloader', daemon=True)
+
+    def track(self, name, path, config, collector, wrapper, registry):
+        self.modules[name] = _Module(name, path, config, collector, wrapper, registry)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    '''
+    Ask for a reload, safe to call from a signal handler.
+    '''
+    def request_reload(self):
+        self._reload.set()
+
+    def run(self):
+        while True:
+            requested = self._reload.wait(self.watch_interval)
+            self._reload.clear()
+            for module in list(self.modules.values()):
+                if requested or module.modified() != module.mtime:
+                    self.reload(module)
+
+    def reload(self, module: _Module):
+        module.mtime = module.modified()
+        try:
+            config = load_config(module.path)
+            if vars(config) == vars(module.config):
+                logging.info('Config of module {} is unchanged'.format(module.name))
+                return
+            for option in restart_options:
+                if getattr(config, option) != getattr(module.config, option):
+                    logging.warning('{} of module {} changed, it only applies after a restart'.format(option, module.name))
+            module.collector.reconfigure(config, self.shared)
+        except Exception as e:
+            configReloadCounter.labels(module.name, 'failure').inc()
+            logging.error('Error reloading {}, keep serving the previous config'.format(module.path), exc_info=e)
+            return
+        module.config = config
+        try:
+            self.rewrap(module, config)
+        except Exception as e:
+            configReloadCounter.labels(module.name, 'failure').inc()
+            logging.error('Error applying polling_interval of module {}'.format(module.name), exc_info=e)
+            return
+        configReloadCounter.labels(module.name, 'success').inc()
+        configReloadTimeGauge.labels(module.name).set(time.time())
+        logging.info('Reloaded module {} from {}'.format(module.name, module.path))
+
+    '''
+    Update the polling or coalescing wrapper in place, or swap it in the
+    registry when polling_interval is turned on or off.
+    '''
+    def rewrap(self, module: _Module, config: CollectorConfig):
+        wrapper = module.wrapper
+        if config.polling_interval and isinstance(wrapper, PollingCollector):
+            wrapper.interval = config.polling_interval
+            return
+        if not config.polling_interval and isinstance(wrapper, CoalescingCollector):
+            wrapper.window = config.coalesce_window
+            return
+        if config.polling_interval:
+            wrapper = PollingCollector(module.collector, config.polling_interval)
+            if self.state is not None:
+                self.state.track('snapshot/' + module.name, wrapper, replace=True)
+            wrapper.start()
+        else:
+            wrapper = CoalescingCollector(module.collector, config.coalesce_window)
+            if self.state is not None:
+                self.state.untrack('snapshot/' + module.name)
+        module.registry.register(wrapper)
+        module.registry.unregister(module.wrapper)
+        if isinstance(module.wrapper, PollingCollector):
+            module.wrapper.stop()
+        module.wrapper = wrapper
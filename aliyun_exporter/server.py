@@ -0,0 +1,70 @@
+import logging
+import socket
+
+from socketserver import ThreadingMixIn
+from wsgiref import simple_server
+
+'''
+wsgiref server handling each connection on its own thread, with HTTP/1.1
+keep-alive.
+
+The plain wsgiref server serves one request at a time and closes every
+connection, so a slow /metrics scrape blocks the web UI and other
+scrapers. The WSGI gateway is still wsgiref's ServerHandler, only
+answering as HTTP/1.1. A connection is kept open when the response has a
+Content-Length, which wsgiref sets for single-block responses like the
+exposition text, and closed otherwise.
+'''
+class ServerHandler(simple_server.ServerHandler):
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        # Without a length the client can only find the end of the body when
+        # the connection is closed, and a HEAD body would be read as the next
+        # response
+        if 'Content-Length' not in self.headers or self.environ['REQUEST_METHOD'] == 'HEAD':
+            self.headers['Connection'] = 'close'
+        if self.headers.get('Connection', '').lower() == 'close':
+            self.request_handler.close_connection = True
+
+    def log_exception(self, exc_info):
+        logging.error('Error serving {}'.format(self.environ.get('PATH_INFO')), exc_info=exc_info)
+
+
+class WSGIRequestHandler(simple_server.WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 120
+
+    # Loop over the requests of the connection until one asks to close it
+    handle = simple_server.BaseHTTPRequestHandler.handle
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+class WSGIServer(ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
+def make_server(host: str, port: int, app) -> WSGIServer:
+    return simple_server.make_server(host, port, app, server_class=WSGIServer, handler_class=WSGIRequestHandler)
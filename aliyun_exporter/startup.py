@@ -0,0 +1,4 @@
+import time
+
+# Imported first by the package, startup metrics are relative to it
+start_time = time.time()
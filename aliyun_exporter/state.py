@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from array import array
+from prometheus_client import Counter, Summary
+from prometheus_client.core import Metric
+
+from aliyun_exporter.columns import DatapointTable, intern_label
+from aliyun_exporter.info_provider import Inventory
+from aliyun_exporter.polling import Snapshot
+
+stateWriteSummary = Summary('aliyun_exporter_state_write_duration_seconds', 'Duration of writing the state file')
+stateWriteFailedCounter = Counter('aliyun_exporter_state_write_failures', 'Failed writes of the state file')
+
+# Bumped whenever the layout of the state changes, older files are ignored
+STATE_VERSION = 3
+
+# Named tuples the state may hold, by tag
+named_tuples = {'Inventory': Inventory, 'Snapshot': Snapshot}
+
+
+'''
+Encode the state as JSON. Dicts, tuples and the few other types the state
+holds are written as a one-key object tagged with their type, so reading
+the file back only ever builds plain data, metric families and
+DatapointTables, never objects of a type named by the file.
+'''
+def encode(obj):
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, list):
+        return [encode(v) for v in obj]
+    if isinstance(obj, dict):
+        return {'dict': [[encode(k), encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, Metric):
+        return {'family': [obj.name, obj.documentation, obj.type,
+                           [[s.name, s.labels, s.value, s.timestamp] for s in obj.samples]]}
+    if isinstance(obj, DatapointTable):
+        return {'table': [list(obj.label_keys), [list(row) for row in obj.rows],
+                          {k: list(v) for k, v in obj.values.items()}]}
+    if isinstance(obj, tuple):
+        tag = type(obj).__name__ if type(obj) in named_tuples.values() else 'tuple'
+        return {tag: [encode(v) for v in obj]}
+    raise TypeError('Cannot save {} in the state file'.format(type(obj).__name__))
+
+
+def decode(obj):
+    if not isinstance(obj, (list, dict)):
+        return obj
+    if isinstance(obj, list):
+        return [decode(v) for v in obj]
+    (tag, value), = obj.items()
+    if tag == 'dict':
+        return {decode(k): decode(v) for k, v in value}
+    if tag == 'family':
+        name, documentation, typ, samples = value
+        family = Metric(name, documentation, typ)
+        for sample_name, labels, sample_value, timestamp in samples:
+            family.add_sample(sample_name, {k: intern_label(v) for k, v in labels.items()}, sample_value, timestamp)
+        return family
+    if tag == 'table':
+        label_keys, rows, values = value
+        return DatapointTable(tuple(intern_label(k) for k in label_keys),
+                              [tuple(intern_label(v) for v in row) for row in rows],
+                              {k: array('d', v) for k, v in values.items()})
+    if tag == 'tuple':
+        return tuple(decode(v) for v in value)
+    if tag in named_tuples:
+        return named_tuples[tag](*(decode(v) for v in value))
+    raise ValueError('Unknown type {} in the state file'.format(tag))
+
+'''
+StateStore keeps the inventory, period cache and metric snapshots on disk,
+so a restarted exporter serves them right away instead of starting cold.
+
+Every tracked source has dump() and restore(): the saved state of a source
+is restored as soon as it is tracked, with its original timestamps, so the
+usual refresh logic picks up from there. A background thread writes the
+state every 'interval' seconds and at exit, to a temporary file first that
+then replaces the state file, so a crash never leaves a partial file. The
+file is JSON, see encode().
+'''
+class StateStore(object):
+
+    def __init__(self, path: str, interval: float = 60):
+        self.path = path
+        self.interval = interval
+        self.sources = dict()
+        self.saved = self.read()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='state-writer', daemon=True)
+        self._write_lock = threading.Lock()
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != STATE_VERSION:
+                logging.info('Ignoring state file {} of another version'.format(self.path))
+                return {}
+            state = decode(data['state'])
+        except Exception as e:
+            logging.error('Error reading state file {}, starting cold'.format(self.path), exc_info=e)
+            return {}
+        logging.info('Loaded state file {} written at {}'.format(self.path, time.ctime(data['timestamp'])))
+        return state
+
+    def track(self, name, source, replace=False):
+        if name in self.sources and not replace:
+            return
+        self.sources[name] = source
+        if name in self.saved:
+            try:
+                source.restore(self.saved.pop(name))
+            except Exception as e:
+                logging.error('Error restoring {} from the state file'.format(name), exc_info=e)
+
+    def untrack(self, name):
+        self.sources.pop(name, None)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.write)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        with self._write_lock:
+            start_time = time.time()
+            tmp = None
+            try:
+                state = {name: source.dump() for name, source in list(self.sources.items())}
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.state-')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'version': STATE_VERSION, 'timestamp': time.time(), 'state': encode(state)}, f,
+                              separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except Exception as e:
+                stateWriteFailedCounter.inc()
+                logging.error('Error writing state file {}'.format(self.path), exc_info=e)
+                if tmp is not None and os.path.exists(tmp):
+                    os.unlink(tmp)
+                return
+            stateWriteSummary.observe(time.time() - start_time)
@@ -0,0 +1,58 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from aliyun_exporter.cache import PeriodCache, RefreshingCache
+
+
+def test_period_cache_expires_at_window_boundary():
+    cache = PeriodCache()
+    points = [{'timestamp': 540 * 1000, 'Average': 1.0}]
+    cache.put('k', 60, points, now=610)
+    assert cache.get('k', now=619) is points
+    assert cache.get('k', now=660) is None
+
+
+def test_period_cache_skips_not_yet_ingested_window():
+    cache = PeriodCache()
+    points = [{'timestamp': 480 * 1000, 'Average': 1.0}]
+    cache.put('k', 60, points, now=610)
+    assert cache.get('k', now=611) is None
+
+
+def test_refreshing_cache_keeps_last_good_value():
+    cache = RefreshingCache(refresh_after=0)
+    assert cache.get('ecs', lambda: 'v1') == 'v1'
+
+    def failing():
+        raise Exception('throttled')
+    assert cache.get('ecs', failing) == 'v1'
+    time.sleep(0.1)
+    assert cache.get('ecs', lambda: 'v2') == 'v1'
+    time.sleep(0.1)
+    assert cache.get('ecs', lambda: 'v3') == 'v2'
+
+
+def test_refreshing_cache_evicts_unread_entries():
+    cache = RefreshingCache(refresh_after=60, expire_after=0.1)
+    assert cache.get('ecs', lambda: 'v1') == 'v1'
+    assert cache.peek('ecs') == 'v1'
+    time.sleep(0.2)
+    assert cache.peek('ecs') is None
+
+
+def test_refreshing_cache_loads_keys_in_parallel():
+    cache = RefreshingCache(refresh_after=60)
+    loads = []
+
+    def slow(key):
+        time.sleep(0.2)
+        loads.append(key)
+        return key
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda key: cache.get(key, lambda: slow(key)), ['ecs', 'rds', 'slb', 'ecs']))
+    assert results == ['ecs', 'rds', 'slb', 'ecs']
+    assert sorted(loads) == ['ecs', 'rds', 'slb']
+    assert time.time() - start_time < 0.4
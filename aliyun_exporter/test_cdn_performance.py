@@ -0,0 +1,47 @@
+import json
+import random
+import time
+
+from aliyun_exporter.test_collector import make_collector
+
+
+class FakeCDNClient(object):
+
+    def __init__(self, domains):
+        self.domains = domains
+        self.calls = []
+
+    def do_action_with_exception(self, req):
+        action = req.get_action_name()
+        domain = req.get_query_params()['DomainName']
+        self.calls.append((action, domain))
+        # Answer out of order so results only line up if they are kept by domain
+        time.sleep(random.uniform(0, 0.02))
+        value = self.domains[domain]
+        if action == 'DescribeDomainRealTimeSrcBpsData':
+            return json.dumps({'RealTimeSrcBpsDataPerInterval': {'DataModule': [{'Value': value}]}})
+        return json.dumps({'RealTimeSrcHttpCodeData': {'UsageData': [{'Value': {'RealTimeSrcCodeProportionData': [
+            {'Code': '200', 'Proportion': value / 10}]}}]}})
+
+
+def test_domains_are_looked_up_once_and_kept_apart(fake_inventory):
+    domains = {'d{}.example.com'.format(i): float(i) for i in range(8)}
+    client = FakeCDNClient(domains)
+    metrics = [{'name': 'DescribeDomainRealTimeSrcBpsData'}, {'name': 'DescribeDomainRealTimeSrcHttpCodeData'}]
+    collector = make_collector({'cdn_performance': metrics}, client=client)
+    collector.info_provider = fake_inventory(sorted(domains))
+    cdn = collector.special_collectors['cdn_performance']
+
+    families = list(cdn.collect())
+    assert collector.info_provider.calls == 1
+    assert len(client.calls) == 2 * len(domains)
+    bps = {s.labels['instanceId']: s.value for f in families
+           if f.name == 'aliyun_cdn_performance_DescribeDomainRealTimeSrcBpsData' for s in f.samples}
+    codes = {s.labels['instanceId']: s.value for f in families
+             if f.name == 'aliyun_cdn_performance_DescribeDomainRealTimeSrcHttpCodeData' for s in f.samples}
+    assert bps == domains
+    assert codes == {domain: value / 10 for domain, value in domains.items()}
+    assert families[-1].name == 'aliyun_cdn_performance_up' and families[-1].samples[0].value == 1.0
+
+    list(cdn.collect())
+    assert collector.info_provider.calls == 2
@@ -0,0 +1,27 @@
+import time
+
+from aliyun_exporter.circuit_breaker import CircuitBreaker
+
+
+def test_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(threshold=2, base_delay=0.05)
+    key = ('acs_ecs_dashboard', 'CPUUtilization', 'cn-hangzhou')
+    breaker.record_failure(key)
+    assert breaker.allow(key)
+    breaker.record_failure(key)
+    assert not breaker.allow(key)
+
+    time.sleep(0.06)
+    assert breaker.allow(key)
+    assert not breaker.allow(key)
+    breaker.record_success(key)
+    assert breaker.allow(key)
+
+
+def test_backoff_doubles():
+    breaker = CircuitBreaker(threshold=1, base_delay=10, max_delay=15)
+    key = ('p', 'm', 'cn-hangzhou')
+    breaker.record_failure(key)
+    first = breaker.entries[key][1]
+    breaker.record_failure(key)
+    assert breaker.entries[key][1] - first > 4
@@ -0,0 +1,27 @@
+import threading
+
+from aliyunsdkcms.request.v20180308 import QueryMetricLastRequest
+
+from aliyun_exporter.client_pool import PooledAcsClient, reuse_ratio
+from aliyun_exporter.server import make_server
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'{"Datapoints": "[]"}']
+
+
+def test_connections_are_reused():
+    httpd = make_server('127.0.0.1', 0, app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        client = PooledAcsClient(ak='id', secret='secret', region_id='cn-hangzhou',
+                                 port=httpd.server_port, pool_size=2)
+        for _ in range(3):
+            req = QueryMetricLastRequest.QueryMetricLastRequest()
+            req.set_endpoint('127.0.0.1')
+            assert client.do_action_with_exception(req) == b'{"Datapoints": "[]"}'
+        assert reuse_ratio('127.0.0.1') > 0.6
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
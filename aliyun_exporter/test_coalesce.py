@@ -0,0 +1,61 @@
+import threading
+import time
+
+from prometheus_client.core import GaugeMetricFamily
+
+from aliyun_exporter.coalesce import CoalescingCollector
+from aliyun_exporter.deadline import set_deadline
+
+
+class SlowCollector(object):
+
+    def __init__(self, delay=0.1):
+        self.calls = 0
+        self.delay = delay
+
+    def collect(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        yield GaugeMetricFamily('aliyun_test', '', value=self.calls)
+
+
+def test_concurrent_scrapes_share_one_collection():
+    delegate = SlowCollector()
+    collector = CoalescingCollector(delegate)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(collector.collect())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert delegate.calls == 1
+    assert all(r is results[0] for r in results)
+
+    collector.collect()
+    assert delegate.calls == 2
+
+
+def test_window_reuses_last_result():
+    delegate = SlowCollector()
+    collector = CoalescingCollector(delegate, window=60)
+    collector.collect()
+    collector.collect()
+    assert delegate.calls == 1
+
+
+def test_follower_stops_waiting_at_its_deadline():
+    delegate = SlowCollector()
+    collector = CoalescingCollector(delegate)
+    first = collector.collect()
+    delegate.delay = 0.5
+    leader = threading.Thread(target=collector.collect)
+    leader.start()
+    time.sleep(0.05)
+    set_deadline(time.time() + 0.1)
+    try:
+        start_time = time.time()
+        assert collector.collect() is first
+        assert time.time() - start_time < 0.3
+    finally:
+        set_deadline(None)
+        leader.join()
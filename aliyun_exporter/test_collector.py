@@ -0,0 +1,221 @@
+import json
+import random
+import time
+
+from aliyun_exporter.collector import AliyunCollector, CollectorConfig
+
+
+class FakeClient(object):
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.calls.append((params.get('Project'), params.get('Metric')))
+        time.sleep(random.uniform(0, self.delay))
+        points = [{'instanceId': 'i-1', 'timestamp': 0, 'Average': 1.0}]
+        return json.dumps({'Datapoints': json.dumps(points)})
+
+
+def make_collector(metrics, client=None, **kwargs):
+    config = CollectorConfig(
+        credential={'access_key_id': 'id', 'access_key_secret': 'secret', 'region_id': 'cn-hangzhou'},
+        metrics=metrics,
+        **kwargs
+    )
+    collector = AliyunCollector(config)
+    collector.client = client if client is not None else FakeClient()
+    collector.clients = {region: collector.client for region in collector.region_ids}
+    return collector
+
+
+def test_collect_keeps_config_order():
+    metrics = {
+        'acs_ecs_dashboard': [{'name': 'm{}'.format(i)} for i in range(10)],
+        'acs_rds_dashboard': [{'name': 'CpuUsage'}],
+    }
+    collector = make_collector(metrics, client=FakeClient(delay=0.01), rate_limit=100)
+    names = [family.name for family in collector.collect()]
+    expected = []
+    for project, items in metrics.items():
+        for item in items:
+            name = 'aliyun_{}_{}'.format(project, item['name'])
+            expected += [name, name + '_up']
+    assert names == expected
+
+
+class PagedClient(object):
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.requests.append(params)
+        page = int(params.get('Cursor') or 0)
+        points = [{'instanceId': i, 'Average': 1.0} for i in self.pages[page]]
+        data = {'Datapoints': json.dumps(points)}
+        if page + 1 < len(self.pages):
+            data['Cursor'] = str(page + 1)
+        return json.dumps(data)
+
+
+def test_query_metric_follows_cursor():
+    client = PagedClient([['i-1', 'i-2'], ['i-3']])
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'CPUUtilization'}]}, client=client)
+    gauge = next(collector.collect())
+    assert [s.labels['instanceId'] for s in gauge.samples] == ['i-1', 'i-2', 'i-3']
+
+
+def test_dimensions_are_chunked():
+    client = PagedClient([[]])
+    dimensions = [{'instanceId': 'i-{}'.format(i)} for i in range(5)]
+    metric = {'name': 'CPUUtilization', 'dimensions': dimensions, 'dimensions_chunk_size': 2}
+    collector = make_collector({'acs_ecs_dashboard': [metric]}, client=client)
+    list(collector.collect())
+    assert [len(json.loads(r['Dimensions'])) for r in client.requests] == [2, 2, 1]
+
+
+class SlowClient(FakeClient):
+
+    def do_action_with_exception(self, req):
+        if req.get_query_params().get('Metric') == 'slow':
+            time.sleep(0.5)
+        return super().do_action_with_exception(req)
+
+
+def test_collect_returns_partial_results_at_deadline():
+    metrics = {'acs_ecs_dashboard': [{'name': 'slow'}, {'name': 'fast'}]}
+    collector = make_collector(metrics, client=SlowClient(), scrape_timeout=0.2, scrape_timeout_offset=0)
+    families = {f.name: f for f in collector.collect()}
+    assert families['aliyun_acs_ecs_dashboard_slow_up'].samples[0].value == 0
+    assert families['aliyun_acs_ecs_dashboard_fast_up'].samples[0].value == 1
+    assert 'aliyun_acs_ecs_dashboard_fast' in families
+
+
+def test_regions_are_merged_with_region_label():
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'CPUUtilization'}]},
+                               regions=['cn-hangzhou', 'cn-beijing'])
+    families = list(collector.collect())
+    assert [f.name for f in families] == ['aliyun_acs_ecs_dashboard_CPUUtilization',
+                                          'aliyun_acs_ecs_dashboard_CPUUtilization_up']
+    assert [s.labels['region'] for s in families[0].samples] == ['cn-hangzhou', 'cn-beijing']
+    assert [s.labels for s in families[1].samples] == [{'region': 'cn-hangzhou'}, {'region': 'cn-beijing'}]
+
+
+class CurrentClient(FakeClient):
+
+    def do_action_with_exception(self, req):
+        params = req.get_query_params()
+        self.calls.append((params.get('Project'), params.get('Metric')))
+        points = [{'instanceId': 'i-1', 'timestamp': int(time.time()) * 1000, 'Average': 1.0}]
+        return json.dumps({'Datapoints': json.dumps(points)})
+
+
+def test_cached_datapoints_reuse_family():
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'cpu', 'period': 3600}]}, client=CurrentClient())
+    first = list(collector.collect())
+    second = list(collector.collect())
+    assert len(collector.client.calls) == 1
+    assert first[0] is second[0]
+
+
+class DimensionsClient(FakeClient):
+
+    def do_action_with_exception(self, req):
+        dimensions = json.loads(req.get_query_params()['Dimensions'])
+        self.calls.append(dimensions)
+        points = [dict(d, timestamp=int(time.time()) * 1000, Average=1.0) for d in dimensions]
+        return json.dumps({'Datapoints': json.dumps(points)})
+
+
+def test_changed_dimensions_are_not_served_from_cache():
+    metric = {'name': 'cpu', 'period': 3600, 'dimensions': [{'instanceId': 'i-1'}]}
+    collector = make_collector({'acs_ecs_dashboard': [metric]}, client=DimensionsClient())
+    list(collector.collect())
+    list(collector.collect())
+    assert len(collector.client.calls) == 1
+
+    metric['dimensions'] = [{'instanceId': 'i-2'}]
+    gauge = next(collector.collect())
+    assert collector.client.calls[-1] == [{'instanceId': 'i-2'}]
+    assert [s.labels['instanceId'] for s in gauge.samples] == ['i-2']
+    assert len(collector.period_cache.dump()) == 1
+
+
+class SlowInfoProvider(object):
+
+    def get_metrics(self, resource):
+        time.sleep(1)
+
+
+def test_inventory_is_abandoned_at_deadline():
+    collector = make_collector({}, info_metrics=['ecs'], scrape_timeout=0.3, scrape_timeout_offset=0)
+    collector.info_providers = {region: SlowInfoProvider() for region in collector.region_ids}
+    start_time = time.time()
+    families = list(collector.collect())
+    assert time.time() - start_time < 0.8
+    assert [(f.name, f.samples[0].value) for f in families] == [('aliyun_meta_ecs_info_up', 0.0)]
+
+
+class SlowFailingClient(object):
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+
+    def do_action_with_exception(self, req):
+        self.calls += 1
+        time.sleep(self.delay)
+        raise Exception('Throttling.User')
+
+
+def test_hedged_fetch_records_one_breaker_outcome():
+    client = SlowFailingClient(0.2)
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'cpu'}]}, client=client, hedge_after=0.05,
+                               circuit_breaker={'threshold': 3})
+    list(collector.collect())
+    assert client.calls == 2
+    assert collector.circuit_breaker.entries[('acs_ecs_dashboard', 'cpu', 'cn-hangzhou')][0] == 1
+
+
+def test_half_open_probe_is_not_hedged():
+    client = SlowFailingClient(0.2)
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'cpu'}]}, client=client, hedge_after=0.05,
+                               circuit_breaker={'threshold': 1, 'base_delay': 0.01})
+    list(collector.collect())
+    families = list(collector.collect())
+    assert client.calls == 2
+    assert families[-1].samples[0].value == 0.0
+
+    time.sleep(0.02)
+    client.calls = 0
+    list(collector.collect())
+    assert client.calls == 1
+
+
+class EmptyInfoProvider(object):
+
+    def get_metrics(self, resource):
+        return None
+
+
+def test_empty_inventory_is_up():
+    collector = make_collector({}, info_metrics=['ecs', 'slb'], scrape_timeout=5, scrape_timeout_offset=0)
+    collector.info_providers = {region: EmptyInfoProvider() for region in collector.region_ids}
+    families = list(collector.collect())
+    assert [(f.name, f.samples[0].value) for f in families] == [('aliyun_meta_ecs_info_up', 1.0),
+                                                               ('aliyun_meta_slb_info_up', 1.0)]
+
+
+def test_merged_regions_reuse_family():
+    collector = make_collector({'acs_ecs_dashboard': [{'name': 'cpu', 'period': 3600}]}, client=CurrentClient(),
+                               regions=['cn-hangzhou', 'cn-beijing'])
+    first = list(collector.collect())
+    second = list(collector.collect())
+    assert len(collector.client.calls) == 2
+    assert first[0] is second[0]
+    assert first[1] is second[1]
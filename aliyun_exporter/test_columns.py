@@ -0,0 +1,22 @@
+from aliyun_exporter.columns import DatapointTable
+
+
+def make_points(*ids):
+    return [{'instanceId': i, 'userId': 1, 'timestamp': 60000, 'Average': float(n)} for n, i in enumerate(ids)]
+
+
+def test_from_points_splits_labels_and_values():
+    table = DatapointTable.from_points(make_points('i-1', 'i-2'))
+    assert table.label_keys == ('instanceId', 'userId')
+    assert table.rows == [('i-1', '1'), ('i-2', '1')]
+    assert list(table.column('Average')) == [0.0, 1.0]
+    assert table.latest_timestamp() == 60000
+    assert len(DatapointTable.from_points([])) == 0
+
+
+def test_from_points_reuses_rows_of_previous_table():
+    previous = DatapointTable.from_points(make_points('i-1', 'i-2'))
+    table = DatapointTable.from_points(make_points('i-2', 'i-3'), previous=previous)
+    assert table.label_keys is previous.label_keys
+    assert table.rows[0] is previous.rows[1]
+    assert table.rows[1][1] is previous.rows[0][1]
@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from aliyun_exporter import decoding
+
+
+@pytest.mark.parametrize('name', decoding.decoders)
+def test_load_datapoints(name):
+    try:
+        decoding.select_decoder(name)
+    except Exception:
+        pytest.skip('{} is not installed'.format(name))
+    points = [{'instanceId': 'i-1', 'Average': 1.5}]
+    resp = json.dumps({'Datapoints': json.dumps(points), 'Cursor': 'c1'}).encode('utf-8')
+    assert decoding.load_datapoints(resp) == (points, 'c1')
+    assert decoding.load_datapoints(b'{"Code": "403"}') == (None, None)
+    decoding.select_decoder()
+
+
+def test_unknown_decoder():
+    with pytest.raises(Exception):
+        decoding.select_decoder('nojson')
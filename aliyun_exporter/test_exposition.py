@@ -0,0 +1,60 @@
+import gzip
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from aliyun_exporter.exposition import RenderCache, make_cached_wsgi_app
+
+
+class FamiliesCollector(object):
+
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def make_family(name, value):
+    gauge = GaugeMetricFamily(name, '', labels=['instanceId'])
+    gauge.add_metric(['i-1'], value)
+    return gauge
+
+
+def test_render_reuses_unchanged_families():
+    cache = RenderCache()
+    first, second = make_family('aliyun_a', 1), make_family('aliyun_b', 2)
+    cache.render([first, second])
+    block = cache.blocks[id(first)]
+
+    changed = make_family('aliyun_b', 3)
+    output = cache.render([first, changed])
+    assert cache.blocks[id(first)] is block
+    assert id(second) not in cache.blocks
+    assert b'aliyun_b{instanceId="i-1"} 3.0' in output
+
+
+def test_cached_app_matches_prometheus_output():
+    registry = CollectorRegistry()
+    registry.register(FamiliesCollector([make_family('aliyun_a', 1), make_family('aliyun_b', 2)]))
+    app = make_cached_wsgi_app(registry)
+    headers = []
+
+    def start_response(status, response_headers):
+        headers[:] = response_headers
+
+    for _ in range(2):
+        plain = b''.join(app({'REQUEST_METHOD': 'GET'}, start_response))
+        assert plain == generate_latest(registry)
+        compressed = b''.join(app({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response))
+        assert ('Content-Encoding', 'gzip') in headers
+        assert gzip.decompress(compressed) == plain
+
+
+def test_gzip_is_only_built_when_asked_for():
+    cache = RenderCache()
+    family = make_family('aliyun_a', 1.0)
+    plain = cache.render([family])
+    assert [block[2] for block in cache.blocks.values()] == [None]
+    assert gzip.decompress(cache.render([family], compress=True)) == plain
+    assert cache.blocks[id(family)][2] is not None
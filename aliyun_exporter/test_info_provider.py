@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from prometheus_client import REGISTRY
+
+from aliyun_exporter.info_provider import InfoProvider
+
+
+class FakeSLBClient(object):
+
+    def __init__(self, listeners):
+        self.listeners = listeners
+        self.actions = []
+        self.failing = set()
+
+    def do_action_with_exception(self, req):
+        action = req.get_action_name()
+        params = req.get_query_params()
+        self.actions.append(action)
+        if params.get('LoadBalancerId') in self.failing:
+            raise Exception('Throttling.User')
+        if action == 'DescribeLoadBalancers':
+            return json.dumps({'LoadBalancers': {'LoadBalancer': [
+                {'LoadBalancerId': slb_id} for slb_id in sorted(self.listeners)]}})
+        if action == 'DescribeLoadBalancerAttribute':
+            ports = self.listeners[params['LoadBalancerId']]
+            return json.dumps({'ListenerPortsAndProtocol': {'ListenerPortAndProtocol': [
+                {'ListenerProtocol': protocol, 'ListenerPort': port} for protocol, port in ports]}})
+        return json.dumps({'Bandwidth': params['ListenerPort']})
+
+
+def test_slb_info_only_requeries_changed_listeners():
+    client = FakeSLBClient({'lb-1': [('tcp', 80)], 'lb-2': [('http', 8080), ('udp', 53)]})
+    provider = InfoProvider(client)
+    gauge = provider.slb_info().family
+    assert sorted((s.labels['instanceId'], s.value) for s in gauge.samples) == [('lb-1', 80.0), ('lb-2', 8080.0)]
+
+    client.listeners['lb-1'] = [('tcp', 80), ('https', 443)]
+    client.actions = []
+    gauge = provider.slb_info().family
+    assert client.actions.count('DescribeLoadBalancerHTTPListenerAttribute') == 0
+    assert client.actions.count('DescribeLoadBalancerHTTPSListenerAttribute') == 1
+    assert len(gauge.samples) == 3
+
+
+def test_slb_info_keeps_last_bandwidths_of_failing_load_balancer():
+    client = FakeSLBClient({'lb-1': [('tcp', 80)], 'lb-2': [('http', 8080)]})
+    provider = InfoProvider(client)
+    provider.slb_info()
+
+    client.listeners['lb-1'] = [('tcp', 81)]
+    client.listeners['lb-3'] = [('tcp', 90)]
+    client.failing = {'lb-1', 'lb-3'}
+    gauge = provider.slb_info().family
+    assert sorted((s.labels['instanceId'], s.value) for s in gauge.samples) == [('lb-1', 80.0), ('lb-2', 8080.0)]
+
+    client.failing = set()
+    gauge = provider.slb_info().family
+    assert sorted((s.labels['instanceId'], s.value) for s in gauge.samples) == [
+        ('lb-1', 81.0), ('lb-2', 8080.0), ('lb-3', 90.0)]
+
+
+def test_inventory_refreshes_are_reported_per_region():
+    hangzhou = InfoProvider(FakeSLBClient({'lb-1': [('tcp', 80)]}), region='cn-hangzhou')
+    beijing = InfoProvider(FakeSLBClient({'lb-2': [('tcp', 80)]}), region='cn-beijing')
+    hangzhou.get_metrics('slb')
+    beijing.get_metrics('slb')
+    for region in ('cn-hangzhou', 'cn-beijing'):
+        labels = {'resource': 'slb', 'region': region}
+        assert REGISTRY.get_sample_value('aliyun_exporter_inventory_refresh_duration_seconds', labels) >= 0
+        assert REGISTRY.get_sample_value('aliyun_exporter_inventory_age_seconds', labels) < 60
+
+
+class FakeECSClient(object):
+
+    def __init__(self, count):
+        self.count = count
+
+    def do_action_with_exception(self, req):
+        return json.dumps({'Instances': {'Instance': [
+            {'InstanceId': 'i-{}'.format(i), 'InstanceName': 'web-{}'.format(i), 'ExpiredTime': '2099-01-01',
+             'Cpu': 2, 'Tags': {'Tag': []}} for i in range(self.count)]}})
+
+
+def test_info_labels_filter_rename_and_budget():
+    info_labels = {'ecs': {'allow': ['InstanceName', 'ExpiredTime', 'Cpu'], 'deny': ['ExpiredTime'],
+                           'rename': {'InstanceName': 'name'}, 'max_series': 2}}
+    provider = InfoProvider(FakeECSClient(3), info_labels=info_labels)
+    inventory = provider.ecs_info()
+    assert [s.labels for s in inventory.family.samples] == [
+        {'InstanceId': 'i-0', 'name': 'web-0', 'Cpu': '2'},
+        {'InstanceId': 'i-1', 'name': 'web-1', 'Cpu': '2'},
+    ]
+    # Instances past the budget keep their CloudMonitor dimensions
+    assert inventory.ids == ['i-0', 'i-1', 'i-2']
+
+
+def test_info_labels_keep_id_label():
+    with pytest.raises(Exception, match='InstanceId'):
+        InfoProvider(FakeECSClient(1), info_labels={'ecs': {'rename': {'InstanceId': 'id'}}})
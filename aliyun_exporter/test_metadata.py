@@ -0,0 +1,47 @@
+import json
+
+from aliyun_exporter.metadata import MetadataIndex
+
+
+class FakeMetaClient(object):
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.calls = 0
+
+    def do_action_with_exception(self, req):
+        self.calls += 1
+        params = req.get_query_params()
+        if req.get_action_name() == 'QueryProjectMeta':
+            items = [{'Project': name, 'Description': name} for name in sorted(self.metrics)]
+        else:
+            items = self.metrics[params['Project']]
+        size = int(params['PageSize'])
+        start = (int(params['PageNumber']) - 1) * size
+        return json.dumps({'Resources': {'Resource': items[start:start + size]}})
+
+
+def test_metadata_index_reads_every_page():
+    client = FakeMetaClient({'acs_ecs_dashboard': [{'Metric': 'cpu_{}'.format(i)} for i in range(5)]})
+    index = MetadataIndex(client, page_size=2)
+    assert len(index.metrics('acs_ecs_dashboard')) == 5
+    assert client.calls == 3
+
+    index.metrics('acs_ecs_dashboard')
+    assert client.calls == 3
+
+
+def test_metadata_search_uses_crawled_index():
+    client = FakeMetaClient({
+        'acs_ecs_dashboard': [{'Metric': 'CPUUtilization', 'Description': 'CPU usage'}],
+        'acs_rds_dashboard': [{'Metric': 'MemoryUsage', 'Description': 'Memory usage'}],
+    })
+    index = MetadataIndex(client, page_size=2)
+    assert index.search('cpu') == []
+
+    index.crawl()
+    calls = client.calls
+    assert [(p, m['Metric']) for p, m in index.search('usage')] == [
+        ('acs_ecs_dashboard', 'CPUUtilization'), ('acs_rds_dashboard', 'MemoryUsage')]
+    assert [m['Metric'] for _, m in index.search('rds')] == ['MemoryUsage']
+    assert client.calls == calls
@@ -0,0 +1,90 @@
+import pytest
+import yaml
+
+from prometheus_client.core import REGISTRY, CollectorRegistry, GaugeMetricFamily
+
+from aliyun_exporter import load_modules, parse_modules
+from aliyun_exporter.collector import AliyunCollector, CollectorConfig, SharedResources
+from aliyun_exporter.reload import ConfigReloader
+from aliyun_exporter.web import make_metrics_app
+
+credential = {'access_key_id': 'id', 'access_key_secret': 'secret', 'region_id': 'cn-hangzhou'}
+
+
+class StaticCollector(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def collect(self):
+        gauge = GaugeMetricFamily(self.name, '')
+        gauge.add_metric([], 1)
+        yield gauge
+
+
+def get(app, query=''):
+    status = []
+    body = b''.join(app({'REQUEST_METHOD': 'GET', 'QUERY_STRING': query},
+                        lambda s, headers: status.append(s)))
+    return status[0], body.decode('utf-8')
+
+
+def make_registry(name):
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(StaticCollector(name))
+    return registry
+
+
+def test_modules_are_routed_by_query():
+    app = make_metrics_app({'redis': make_registry('redis_metric'), 'slb': make_registry('slb_metric')})
+    status, body = get(app, 'module=redis')
+    assert status.startswith('200') and 'redis_metric' in body and 'slb_metric' not in body
+    status, body = get(app, 'module=slb')
+    assert status.startswith('200') and 'slb_metric' in body and 'redis_metric' not in body
+    status, body = get(app, 'module=ecs')
+    assert status.startswith('404') and body == 'Unknown module ecs'
+
+
+def test_default_registry_is_served_without_module():
+    app = make_metrics_app({'redis': make_registry('redis_metric')})
+    status, body = get(app)
+    assert status.startswith('200') and 'redis_metric' not in body and 'python_info' in body
+
+    collector = StaticCollector('single_module_metric')
+    REGISTRY.register(collector)
+    try:
+        app = make_metrics_app({'redis': REGISTRY})
+        assert 'single_module_metric' in get(app)[1]
+        assert 'single_module_metric' in get(app, 'module=redis')[1]
+    finally:
+        REGISTRY.unregister(collector)
+
+
+def test_modules_share_resources():
+    shared = SharedResources()
+    redis = AliyunCollector(CollectorConfig(credential=credential, metrics={'acs_kvstore': [{'name': 'CpuUsage'}]}),
+                            shared)
+    slb = AliyunCollector(CollectorConfig(credential=credential, metrics={'acs_slb_dashboard': [{'name': 'Qps'}]}),
+                          shared)
+    assert redis.client is slb.client
+    assert redis.info_provider is slb.info_provider
+    assert redis.client.limiters is slb.client.limiters
+    assert redis.metrics is not slb.metrics and redis.tables is not slb.tables
+
+
+def test_duplicate_module_names_are_rejected():
+    assert parse_modules(['conf/redis.yml', 'slb=conf/lb.yml']) == [('redis', 'conf/redis.yml'), ('slb', 'conf/lb.yml')]
+    with pytest.raises(Exception, match='Duplicate module name redis'):
+        parse_modules(['conf/redis.yml', 'backup/redis.yml'])
+
+
+def test_every_module_is_tracked_by_a_later_state_file(tmp_path):
+    paths = []
+    for name, cfg in [('redis', {}), ('slb', {'state_file': str(tmp_path / 'state.json')})]:
+        paths.append(str(tmp_path / (name + '.yml')))
+        with open(paths[-1], 'w') as f:
+            yaml.dump(dict(cfg, credential=credential, metrics={'acs_kvstore': [{'name': 'CpuUsage'}]}), f)
+    shared = SharedResources()
+    configs, registries, state = load_modules(paths, shared, ConfigReloader(shared))
+    assert sorted(registries) == ['redis', 'slb']
+    assert sorted(state.sources) == ['inventory/id/cn-hangzhou', 'period/redis', 'period/slb']
@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+from aliyun_exporter.collector import special_projects
+from aliyun_exporter.plugins import LazyRegistry
+from aliyun_exporter.test_collector import make_collector
+
+
+def test_registry_imports_on_first_lookup():
+    registry = LazyRegistry('test', {'loads': 'json:loads'})
+    assert 'loads' in registry
+    assert registry.loaded == {}
+    assert registry.get('loads') is json.loads
+    with pytest.raises(Exception):
+        registry.get('dumps')
+
+
+def test_special_collectors_are_built_from_registry():
+    collector = make_collector({'rds_performance': [{'name': 'MySQL_QPSTPS'}]})
+    assert list(collector.special_collectors) == ['rds_performance']
+    assert isinstance(collector.special_collectors['rds_performance'], special_projects.get('rds_performance'))
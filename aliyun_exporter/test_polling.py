@@ -0,0 +1,28 @@
+from prometheus_client.core import GaugeMetricFamily
+
+from aliyun_exporter.polling import PollingCollector
+
+
+class FlakyCollector(object):
+
+    def __init__(self):
+        self.fail = False
+
+    def collect(self):
+        if self.fail:
+            raise Exception('boom')
+        yield GaugeMetricFamily('aliyun_test', '', value=1)
+
+
+def test_serves_last_good_snapshot():
+    delegate = FlakyCollector()
+    collector = PollingCollector(delegate, interval=60)
+    names = [f.name for f in collector.collect()]
+    assert names == ['aliyun_exporter_snapshot_age_seconds', 'aliyun_exporter_snapshot_stale']
+
+    collector.refresh()
+    delegate.fail = True
+    collector.refresh()
+    families = {f.name: f for f in collector.collect()}
+    assert 'aliyun_test' in families
+    assert families['aliyun_exporter_snapshot_stale'].samples[0].value == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from aliyunsdkcms.request.v20180308 import QueryMetricLastRequest
+from aliyunsdkcore.acs_exception.exceptions import ServerException
+from prometheus_client import REGISTRY
+
+from aliyun_exporter.ratelimit import RateLimitedClient, RateLimiters, TokenBucket, is_throttling
+
+
+def test_bucket_backs_off_and_recovers():
+    bucket = TokenBucket(10)
+    bucket.throttled()
+    assert bucket.rate == 5
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_limiters_per_product():
+    limiters = RateLimiters({'default': 10, 'Cms': 20})
+    assert limiters.get('cms').max_rate == 20
+    assert limiters.get('Rds').max_rate == 10
+    assert limiters.get('rds') is limiters.get('Rds')
+
+
+def test_metadata_bucket_is_separate_and_slow():
+    limiters = RateLimiters(20)
+    assert limiters.get('cms-meta').max_rate == 1
+    assert limiters.get('cms-meta') is not limiters.get('cms')
+    assert RateLimiters({'cms-meta': 5}).get('cms-meta').max_rate == 5
+
+
+def test_is_throttling():
+    assert is_throttling(ServerException('Throttling.User', 'Request was denied due to user flow control.'))
+    assert not is_throttling(ServerException('InvalidParameter', ''))
+
+
+class ThrottledClient(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def do_action_with_exception(self, req):
+        self.calls += 1
+        if self.calls > 1:
+            raise ServerException('Throttling.User', 'Request was denied due to user flow control.')
+        return b'{}'
+
+
+def test_requests_are_timed_per_action_and_outcome():
+    client = RateLimitedClient(ThrottledClient(), RateLimiters(100))
+    req = QueryMetricLastRequest.QueryMetricLastRequest()
+    req.set_Project('acs_ecs_dashboard')
+    req.set_Metric('cpu_timed')
+    labels = {'product': 'cms', 'action': 'QueryMetricLast', 'project': 'acs_ecs_dashboard', 'metric': 'cpu_timed'}
+    client.do_action_with_exception(req)
+    with pytest.raises(ServerException):
+        client.do_action_with_exception(req)
+    name = 'aliyun_exporter_api_request_duration_seconds_count'
+    assert REGISTRY.get_sample_value(name, dict(labels, outcome='success')) == 1
+    assert REGISTRY.get_sample_value(name, dict(labels, outcome='throttled')) == 1
+    assert REGISTRY.get_sample_value('aliyun_exporter_api_requests_in_flight', {'product': 'cms'}) == 0
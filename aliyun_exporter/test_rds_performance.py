@@ -0,0 +1,68 @@
+import json
+import threading
+
+from aliyun_exporter.test_collector import make_collector
+
+
+class FakeRDSClient(object):
+
+    def __init__(self, empty=()):
+        self.empty = set(empty)
+        self.calls = []
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def do_action_with_exception(self, req):
+        id = req.get_query_params()['DBInstanceId']
+        with self._lock:
+            self.calls.append(id)
+            self.threads.add(threading.current_thread())
+        keys = [] if id in self.empty else [{
+            'Key': 'MySQL_Sessions', 'ValueFormat': 'active_session&total_session',
+            'Values': {'PerformanceValue': [{'Value': '{}&{}'.format(id[-1], int(id[-1]) * 10)}]},
+        }]
+        return json.dumps({'PerformanceKeys': {'PerformanceKey': keys}})
+
+
+def make_rds_collector(inventory, client):
+    collector = make_collector({'rds_performance': [{'name': 'MySQL_Sessions'}]}, client=client)
+    collector.info_provider = inventory
+    rds = collector.special_collectors['rds_performance']
+    rds.query_window = lambda: ('2020-01-01T00:00Z', '2020-01-01T00:01Z')
+    return collector, rds
+
+
+def samples(families):
+    return sorted((f.name, s.labels.get('instanceId'), s.value) for f in families for s in f.samples)
+
+
+def test_instances_are_queried_once_per_window(fake_inventory):
+    ids = ['rm-{}'.format(i) for i in range(1, 6)]
+    client = FakeRDSClient()
+    collector, rds = make_rds_collector(fake_inventory(ids), client)
+    first = samples(rds.collect())
+    assert sorted(client.calls) == ids
+    assert threading.main_thread() not in client.threads
+    assert ('aliyun_rds_performance_MySQL_Sessions_total_session', 'rm-3', 30.0) in first
+    assert ('aliyun_rds_performance_up', None, 1.0) in first
+
+    second = samples(rds.collect())
+    assert sorted(client.calls) == ids
+    assert second == first
+
+    rds.query_window = lambda: ('2020-01-01T00:01Z', '2020-01-01T00:02Z')
+    list(rds.collect())
+    assert len(client.calls) == 2 * len(ids)
+
+
+def test_empty_response_is_not_cached(fake_inventory):
+    client = FakeRDSClient(empty=['rm-2'])
+    collector, rds = make_rds_collector(fake_inventory(['rm-1', 'rm-2']), client)
+    families = samples(rds.collect())
+    assert {id for _, id, _ in families} == {'rm-1', None}
+
+    client.empty = set()
+    families = samples(rds.collect())
+    assert client.calls.count('rm-1') == 1
+    assert client.calls.count('rm-2') == 2
+    assert ('aliyun_rds_performance_MySQL_Sessions_active_session', 'rm-2', 2.0) in families
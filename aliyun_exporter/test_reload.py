@@ -0,0 +1,109 @@
+import yaml
+
+from prometheus_client.core import CollectorRegistry
+
+from aliyun_exporter.coalesce import CoalescingCollector
+from aliyun_exporter.collector import AliyunCollector, SharedResources, special_projects
+from aliyun_exporter.polling import PollingCollector
+from aliyun_exporter.reload import ConfigReloader, load_config
+from aliyun_exporter.test_collector import CurrentClient
+
+credential = {'access_key_id': 'id', 'access_key_secret': 'secret', 'region_id': 'cn-hangzhou'}
+
+
+class FakeShared(SharedResources):
+
+    def __init__(self, client):
+        super().__init__()
+        self.fake = client
+
+    def client(self, config, region=None):
+        return self.fake
+
+
+def write_config(path, **cfg):
+    with open(path, 'w') as f:
+        yaml.dump(dict(cfg, credential=credential), f)
+
+
+def test_reload_only_fetches_changed_metrics(tmp_path):
+    path = str(tmp_path / 'aliyun-exporter.yml')
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu', 'period': 3600}]})
+    client = CurrentClient()
+    shared = FakeShared(client)
+    config = load_config(path)
+    collector = AliyunCollector(config, shared)
+    wrapper = CoalescingCollector(collector)
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(wrapper)
+    reloader = ConfigReloader(shared)
+    reloader.track('ecs', path, config, collector, wrapper, registry)
+    list(collector.collect())
+    info_provider = collector.info_provider
+
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu', 'period': 3600},
+                                                      {'name': 'memory', 'period': 3600}]})
+    reloader.reload(reloader.modules['ecs'])
+    names = [family.name for family in collector.collect()]
+    assert 'aliyun_acs_ecs_dashboard_memory' in names
+    assert [metric for _, metric in client.calls] == ['cpu', 'memory']
+    assert collector.info_provider is info_provider
+
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'memory', 'period': 3600}]}, polling_interval=60)
+    reloader.reload(reloader.modules['ecs'])
+    assert [key[1] for key in collector.tables] == ['memory']
+    assert isinstance(reloader.modules['ecs'].wrapper, PollingCollector)
+    reloader.modules['ecs'].wrapper.stop()
+
+
+def test_broken_config_keeps_previous_one(tmp_path):
+    path = str(tmp_path / 'aliyun-exporter.yml')
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu'}]})
+    shared = FakeShared(CurrentClient())
+    config = load_config(path)
+    collector = AliyunCollector(config, shared)
+    reloader = ConfigReloader(shared)
+    reloader.track('ecs', path, config, collector, CoalescingCollector(collector), CollectorRegistry())
+    with open(path, 'w') as f:
+        f.write('metrics: [')
+    reloader.reload(reloader.modules['ecs'])
+    assert reloader.modules['ecs'].config is config
+    assert collector.metrics == config.metrics
+
+
+def test_failed_reconfigure_keeps_previous_config(tmp_path):
+    path = str(tmp_path / 'aliyun-exporter.yml')
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu'}]})
+    shared = FakeShared(CurrentClient())
+    config = load_config(path)
+    collector = AliyunCollector(config, shared)
+    reloader = ConfigReloader(shared)
+    reloader.track('ecs', path, config, collector, CoalescingCollector(collector), CollectorRegistry())
+    pools = dict(collector.pools)
+    special_projects.register('broken_performance', 'aliyun_exporter.missing_sdk:Collector')
+    try:
+        write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu'}], 'broken_performance': []},
+                     regions=['cn-hangzhou', 'cn-beijing'])
+        reloader.reload(reloader.modules['ecs'])
+    finally:
+        special_projects.entries.pop('broken_performance')
+    assert reloader.modules['ecs'].config is config
+    assert collector.metrics == config.metrics
+    assert collector.region_ids == ['cn-hangzhou']
+    assert collector.pools == pools
+
+
+def test_reload_discards_removed_circuit_breakers(tmp_path):
+    path = str(tmp_path / 'aliyun-exporter.yml')
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu'}, {'name': 'memory'}]})
+    shared = FakeShared(CurrentClient())
+    config = load_config(path)
+    collector = AliyunCollector(config, shared)
+    reloader = ConfigReloader(shared)
+    reloader.track('ecs', path, config, collector, CoalescingCollector(collector), CollectorRegistry())
+    for _ in range(3):
+        collector.circuit_breaker.record_failure(('acs_ecs_dashboard', 'memory', 'cn-hangzhou'))
+
+    write_config(path, metrics={'acs_ecs_dashboard': [{'name': 'cpu'}]})
+    reloader.reload(reloader.modules['ecs'])
+    assert collector.circuit_breaker.keys() == set()
@@ -0,0 +1,90 @@
+import http.client
+import threading
+import time
+
+from aliyun_exporter.server import make_server
+
+
+# A single block, like the exposition app, so wsgiref sets its Content-Length
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['{}?{}'.format(environ['PATH_INFO'], environ['QUERY_STRING']).encode('utf-8')]
+
+
+def test_keep_alive_connection_is_reused():
+    httpd = make_server('127.0.0.1', 0, app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', httpd.server_port)
+        bodies = []
+        for path in ['/metrics?module=redis', '/']:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            bodies.append(resp.read())
+            assert resp.getheader('Content-Length') == str(len(bodies[-1]))
+            assert conn.sock is not None
+        assert bodies == [b'/metrics?module=redis', b'/?']
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def failing_app(environ, start_response):
+    raise Exception('boom')
+
+
+def test_app_error_is_answered_with_500():
+    httpd = make_server('127.0.0.1', 0, failing_app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', httpd.server_port)
+        for _ in range(2):
+            conn.request('GET', '/metrics')
+            resp = conn.getresponse()
+            body = resp.read()
+            assert resp.status == 500
+            assert resp.getheader('Content-Length') == str(len(body))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def streaming_app(environ, start_response):
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(0.5)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return iter([b'a', b'b'])
+
+
+def test_response_without_length_closes_connection():
+    httpd = make_server('127.0.0.1', 0, streaming_app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        for method in ['GET', 'HEAD']:
+            conn = http.client.HTTPConnection('127.0.0.1', httpd.server_port)
+            conn.request(method, '/')
+            resp = conn.getresponse()
+            assert resp.read() == (b'ab' if method == 'GET' else b'')
+            assert resp.getheader('Connection') == 'close'
+            assert resp.will_close
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_slow_request_does_not_block_others():
+    httpd = make_server('127.0.0.1', 0, streaming_app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        slow = http.client.HTTPConnection('127.0.0.1', httpd.server_port)
+        slow.request('GET', '/slow')
+        start_time = time.time()
+        conn = http.client.HTTPConnection('127.0.0.1', httpd.server_port)
+        conn.request('GET', '/')
+        assert conn.getresponse().read() == b'ab'
+        assert time.time() - start_time < 0.4
+        assert slow.getresponse().read() == b'ab'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
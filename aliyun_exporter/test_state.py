@@ -0,0 +1,81 @@
+import json
+import os
+import pickle
+
+from prometheus_client.core import GaugeMetricFamily
+
+from aliyun_exporter.cache import PeriodCache, RefreshingCache
+from aliyun_exporter.columns import DatapointTable
+from aliyun_exporter.info_provider import Inventory
+from aliyun_exporter.polling import Snapshot
+from aliyun_exporter.state import StateStore, decode, encode
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    cache = RefreshingCache(refresh_after=3600)
+    cache.get('ecs', lambda: ['i-1'])
+    period = PeriodCache()
+    period.put('live', 60, [{'timestamp': 600 * 1000}], now=610)
+    period._entries['expired'] = (0, [])
+    store.track('inventory', cache)
+    store.track('period', period)
+    store.write()
+    assert [f for f in os.listdir(str(tmp_path))] == ['state.json']
+
+    restarted = StateStore(path)
+    warm = RefreshingCache(refresh_after=3600)
+    restarted.track('inventory', warm)
+    assert warm.get('ecs', lambda: ['i-2']) == ['i-1']
+    assert warm.dump()['ecs'][1] == cache.dump()['ecs'][1]
+    warm_period = PeriodCache()
+    warm_period.restore(period.dump(), now=615)
+    assert warm_period.get('live', now=615) is not None
+    assert 'expired' not in warm_period.dump()
+
+
+def test_unreadable_state_starts_cold(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_bytes(b'not json')
+    store = StateStore(str(path))
+    cache = RefreshingCache(refresh_after=3600)
+    store.track('inventory', cache)
+    assert cache.dump() == {}
+
+
+def test_state_is_json_of_plain_data():
+    gauge = GaugeMetricFamily('aliyun_meta_ecs_info', '', labels=['InstanceId'])
+    gauge.add_metric(['i-1'], 1.0)
+    table = DatapointTable.from_points([{'instanceId': 'i-1', 'timestamp': 1000, 'Average': 0.5}])
+    state = {
+        'inventory': {'ecs': (Inventory(gauge, ['i-1']), 100.0), 'slb': (Inventory(None, []), 100.0)},
+        'period': {('acs_ecs_dashboard', 'cpu', 60, 'cn-hangzhou', None): (160.0, table)},
+        'snapshot': Snapshot((gauge,), 100.0),
+    }
+    restored = decode(json.loads(json.dumps(encode(state))))
+    inventory, loaded = restored['inventory']['ecs']
+    assert isinstance(inventory, Inventory) and loaded == 100.0
+    assert inventory.family.samples == gauge.samples and inventory.ids == ['i-1']
+    assert restored['inventory']['slb'][0].family is None
+    expires, warm = restored['period'][('acs_ecs_dashboard', 'cpu', 60, 'cn-hangzhou', None)]
+    assert warm.label_keys == table.label_keys and warm.rows == table.rows and warm.values == table.values
+    assert isinstance(restored['snapshot'], Snapshot) and restored['snapshot'].families[0].samples == gauge.samples
+
+
+class Exploit(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (os.mkdir, (self.path,))
+
+
+def test_pickled_state_is_not_loaded(tmp_path):
+    path = tmp_path / 'state.json'
+    exploited = str(tmp_path / 'exploited')
+    path.write_bytes(pickle.dumps({'version': 3, 'timestamp': 0, 'state': Exploit(exploited)}))
+    store = StateStore(str(path))
+    assert store.saved == {}
+    assert not os.path.exists(exploited)
@@ -1,67 +1,85 @@
-import json
+from urllib.parse import parse_qs
 
-from aliyunsdkcore.client import AcsClient
 from flask import (
-    Flask, render_template
+    Flask, render_template, request
 )
-from prometheus_client import make_wsgi_app
+from prometheus_client import REGISTRY
 from werkzeug.middleware import dispatcher
 
-from aliyun_exporter import CollectorConfig
-from aliyun_exporter.QueryMetricMetaRequest import QueryMetricMetaRequest
-from aliyun_exporter.QueryProjectMetaRequest import QueryProjectMetaRequest
+from aliyun_exporter import CollectorConfig, SharedResources
+from aliyun_exporter.deadline import deadline_middleware
+from aliyun_exporter.exposition import make_cached_wsgi_app
+from aliyun_exporter.metadata import MetadataIndex
 from aliyun_exporter.utils import format_metric, format_period
 
 
-def create_app(config: CollectorConfig):
+'''
+Serve the default registry at /metrics and the registry of a module at
+/metrics?module=<name>.
+'''
+def make_metrics_app(registries=None):
+    default = make_cached_wsgi_app(REGISTRY)
+    modules = {name: make_cached_wsgi_app(registry) for name, registry in (registries or {}).items()}
+
+    def app(environ, start_response):
+        module = parse_qs(environ.get('QUERY_STRING', '')).get('module', [None])[0]
+        if module is None:
+            return default(environ, start_response)
+        if module not in modules:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Unknown module {}'.format(module).encode('utf-8')]
+        return modules[module](environ, start_response)
+    return app
+
+
+def create_app(config: CollectorConfig, registries=None, shared: SharedResources = None):
 
     app = Flask(__name__, instance_relative_config=True)
 
-    client = AcsClient(
-        ak=config.credential['access_key_id'],
-        secret=config.credential['access_key_secret'],
-        region_id=config.credential['region_id']
-    )
+    if shared is None:
+        shared = SharedResources()
+    client = shared.metadata_client(config)
+
+    metadata = MetadataIndex(client, ttl=config.metadata_ttl)
 
     @app.route("/")
     def projectIndex():
-        req = QueryProjectMetaRequest()
-        req.set_PageSize(100)
+        metadata.start()
         try:
-            resp = client.do_action_with_exception(req)
+            projects = metadata.projects()
         except Exception as e:
             return render_template("error.html", errorMsg=e)
-        data = json.loads(resp)
-        return render_template("index.html", projects=data["Resources"]["Resource"])
+        return render_template("index.html", projects=projects)
 
     @app.route("/projects/<string:name>")
     def projectDetail(name):
-        req = QueryMetricMetaRequest()
-        req.set_PageSize(100)
-        req.set_Project(name)
+        metadata.start()
         try:
-            resp = client.do_action_with_exception(req)
+            metrics = metadata.metrics(name)
         except Exception as e:
             return render_template("error.html", errorMsg=e)
-        data = json.loads(resp)
-        return render_template("detail.html", metrics=data["Resources"]["Resource"], project=name)
+        return render_template("detail.html", metrics=metrics, project=name)
 
     @app.route("/yaml/<string:name>")
     def projectYaml(name):
-        req = QueryMetricMetaRequest()
-        req.set_PageSize(100)
-        req.set_Project(name)
+        metadata.start()
         try:
-            resp = client.do_action_with_exception(req)
+            metrics = metadata.metrics(name)
         except Exception as e:
             return render_template("error.html", errorMsg=e)
-        data = json.loads(resp)
-        return render_template("yaml.html", metrics=data["Resources"]["Resource"], project=name)
+        return render_template("yaml.html", metrics=metrics, project=name)
+
+    @app.route("/search")
+    def search():
+        metadata.start()
+        query = request.args.get('q', '').strip()
+        results = metadata.search(query) if query else []
+        return render_template("search.html", query=query, results=results)
 
     app.jinja_env.filters['formatmetric'] = format_metric
     app.jinja_env.filters['formatperiod'] = format_period
 
     app_dispatch = dispatcher.DispatcherMiddleware(app, {
-        '/metrics': make_wsgi_app()
+        '/metrics': deadline_middleware(make_metrics_app(registries), config.scrape_timeout_offset)
     })
     return app_dispatch
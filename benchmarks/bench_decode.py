@@ -0,0 +1,54 @@
+'''
+Microbenchmark of the JSON decoders on API responses.
+
+Decodes the responses in benchmarks/payloads (a 1000 datapoint
+QueryMetricLast page and a 100 instance DescribeInstances page) with every
+installed decoder, including the conversion of the datapoints into a
+DatapointTable.
+
+    python benchmarks/bench_decode.py [-n 200]
+'''
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aliyun_exporter import decoding
+from aliyun_exporter.columns import DatapointTable
+
+payloads = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'payloads')
+
+
+def read_payload(name):
+    with open(os.path.join(payloads, name), 'rb') as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON decoder microbenchmark')
+    parser.add_argument('-n', '--number', type=int, default=200, help='iterations per case')
+    args = parser.parse_args()
+
+    datapoints = read_payload('query_metric_last.json')
+    instances = read_payload('describe_instances.json')
+    cases = [
+        ('query_metric_last', lambda: decoding.load_datapoints(datapoints)),
+        ('query_metric_last+table', lambda: DatapointTable.from_points(decoding.load_datapoints(datapoints)[0])),
+        ('describe_instances', lambda: decoding.loads(instances)),
+    ]
+    print('{:<10} {:<26} {:>12}'.format('decoder', 'case', 'us/op'))
+    for name in decoding.decoders:
+        try:
+            decoding.select_decoder(name)
+        except Exception:
+            print('{:<10} not installed'.format(name))
+            continue
+        for case, op in cases:
+            seconds = min(timeit.repeat(op, number=args.number, repeat=3)) / args.number
+            print('{:<10} {:<26} {:>12.1f}'.format(name, case, seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Memory retained between scrapes for one CloudMonitor metric.
+
+Runs a scrape through AliyunCollector and the cached /metrics app against a
+fake client answering 'instances' datapoints, then measures with
+tracemalloc everything the scrape left alive: the DatapointTable in the
+period cache, the family kept for reuse and the rendered exposition text.
+The same is measured for the response kept as decoded dicts next to its
+family and rendered text, the layout before DatapointTable.
+
+    python benchmarks/bench_memory.py [--instances 5000]
+'''
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import GaugeMetricFamily
+
+from aliyun_exporter import decoding
+from aliyun_exporter.collector import AliyunCollector, CollectorConfig
+from aliyun_exporter.exposition import RenderCache, make_cached_wsgi_app
+
+
+class FakeClient(object):
+
+    def __init__(self, instances):
+        points = [{'timestamp': int(time.time()) * 1000, 'userId': '1234567890', 'instanceId': 'i-{:012d}'.format(i),
+                   'Average': i * 0.5, 'Maximum': i * 1.0, 'Minimum': 0.0} for i in range(instances)]
+        self.response = json.dumps({'Datapoints': json.dumps(points)})
+
+    def do_action_with_exception(self, req):
+        return self.response
+
+
+def retained(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return kept, size
+
+
+def make_app(client):
+    config = CollectorConfig(credential={'access_key_id': 'id', 'access_key_secret': 'secret', 'region_id': 'cn-hangzhou'},
+                             metrics={'acs_ecs_dashboard': [{'name': 'CPUUtilization', 'period': 3600}]})
+    collector = AliyunCollector(config)
+    collector.client = client
+    collector.clients = {region: client for region in collector.region_ids}
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(collector)
+    return make_cached_wsgi_app(registry)
+
+
+def scrape(app):
+    app({'REQUEST_METHOD': 'GET'}, lambda status, headers: None)
+
+
+def scrape_dicts(client):
+    points = decoding.load_datapoints(client.response)[0]
+    gauge = GaugeMetricFamily('aliyun_acs_ecs_dashboard_CPUUtilization', '', labels=['userId', 'instanceId'])
+    for point in points:
+        gauge.add_metric([point['userId'], point['instanceId']], point['Average'])
+    cache = RenderCache()
+    cache.render([gauge])
+    return points, gauge, cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retained memory of one CloudMonitor metric')
+    parser.add_argument('--instances', type=int, nargs='+', default=[1000, 5000])
+    args = parser.parse_args()
+
+    # One-off allocations (pool threads, metric children, lazy imports) are
+    # made by a warm-up scrape and not counted
+    scrape(make_app(FakeClient(10)))
+    scrape_dicts(FakeClient(10))
+    print('{:>10} {:>14} {:>14}'.format('instances', 'columns (KiB)', 'dicts (KiB)'))
+    for instances in args.instances:
+        client = FakeClient(instances)
+        app = make_app(client)
+        _, columns = retained(lambda: scrape(app))
+        _, dicts = retained(lambda: scrape_dicts(client))
+        print('{:>10} {:>14.0f} {:>14.0f}'.format(instances, columns / 1024, dicts / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+'''
+Scrape benchmark against a local stand-in of the Aliyun APIs.
+
+For every fleet size the stand-in (benchmarks/standin.py) is started in a
+process of its own, and the exporter runs in another one: first a cold
+load of every InfoProvider resource, then a number of scrapes through
+AliyunCollector.collect. Reported per fleet size are the scrape latency
+percentiles, the API calls made, the CPU time and the peak resident memory
+of the exporter process.
+
+    python benchmarks/bench_scrape.py --instances 10 1000 10000 --latency 0.05 --throttle 0.01
+'''
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import time
+
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aliyun_exporter.client_pool import ClientPool, PooledAcsClient
+from aliyun_exporter.collector import AliyunCollector, CollectorConfig, SharedResources
+from aliyun_exporter.info_provider import InfoProvider
+from aliyun_exporter.server import make_server
+from standin import Fleet, StandIn
+
+info_resources = ['ecs', 'rds', 'redis', 'slb', 'mongodb', 'cdn']
+ecs_metrics = ['CPUUtilization', 'memory_usedutilization', 'diskusage_utilization', 'net_tcpconnection', 'load_1m']
+
+
+class StandInClient(PooledAcsClient):
+
+    def _resolve_endpoint(self, request):
+        return '127.0.0.1'
+
+
+'''
+ClientPool whose clients send every request to the stand-in.
+'''
+class StandInClientPool(ClientPool):
+
+    def __init__(self, pool_size, port):
+        super().__init__(pool_size)
+        self.port = port
+
+    def get(self, access_key_id, access_key_secret, region_id):
+        key = (access_key_id, access_key_secret, region_id)
+        with self._lock:
+            if key not in self.clients:
+                self.clients[key] = StandInClient(
+                    ak=access_key_id,
+                    secret=access_key_secret,
+                    region_id=region_id,
+                    pool_size=self.pool_size,
+                    port=self.port
+                )
+            return self.clients[key]
+
+
+def serve(instances, latency, throttle, ports):
+    httpd = make_server('127.0.0.1', 0, StandIn(Fleet(instances), latency, throttle))
+    ports.put(httpd.server_port)
+    httpd.serve_forever()
+
+
+def api_calls(port):
+    with urlopen('http://127.0.0.1:{}/_stats'.format(port)) as resp:
+        stats = json.loads(resp.read())
+    return sum(stats['calls'].values()), sum(stats['throttled'].values())
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def make_config(args):
+    metric = {'dimensions_from': 'ecs'} if args.dimensions_from else {}
+    return CollectorConfig(
+        credential={'access_key_id': 'bench', 'access_key_secret': 'bench', 'region_id': 'cn-hangzhou'},
+        metrics={'acs_ecs_dashboard': [dict(metric, name=name) for name in ecs_metrics[:args.metrics]]},
+        info_metrics=info_resources,
+        pool_size=args.pool_size,
+        rate_limit=args.rate_limit,
+        period_cache=args.period_cache,
+    )
+
+
+def run(port, args, results):
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    config = make_config(args)
+    shared = SharedResources()
+    shared.client_pool = StandInClientPool(config.connection_pool_size, port)
+
+    calls_before = api_calls(port)[0]
+    provider = InfoProvider(shared.client(config), pool_size=config.pool_size,
+                            region=config.credential['region_id'])
+    inventory = dict()
+    for name in info_resources:
+        start_time = time.time()
+        try:
+            provider.get_metrics(name)
+        except Exception:
+            inventory[name] = None
+            continue
+        inventory[name] = time.time() - start_time
+    inventory_calls = api_calls(port)[0] - calls_before
+
+    collector = AliyunCollector(config, shared)
+    latencies = []
+    series = 0
+    calls_before = api_calls(port)
+    cpu_before = time.process_time()
+    for _ in range(args.scrapes):
+        start_time = time.time()
+        families = list(collector.collect())
+        latencies.append(time.time() - start_time)
+        series = sum(len(family.samples) for family in families)
+    cpu = time.process_time() - cpu_before
+    calls, throttled = [after - before for after, before in zip(api_calls(port), calls_before)]
+    results.put({
+        'latencies': latencies,
+        'series': series,
+        'calls': calls,
+        'throttled': throttled,
+        'cpu': cpu,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'inventory': inventory,
+        'inventory_calls': inventory_calls,
+    })
+
+
+def benchmark(instances, args):
+    ports = multiprocessing.Queue()
+    standin = multiprocessing.Process(target=serve, args=(instances, args.latency, args.throttle, ports), daemon=True)
+    standin.start()
+    try:
+        port = ports.get(timeout=30)
+        results = multiprocessing.Queue()
+        exporter = multiprocessing.Process(target=run, args=(port, args, results))
+        exporter.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                exporter.join()
+                return result
+            except queue.Empty:
+                if not exporter.is_alive():
+                    raise Exception('Benchmark of {} instances failed.'.format(instances))
+    finally:
+        standin.terminate()
+        standin.join()
+
+
+def report(instances, result, scrapes):
+    latencies = result['latencies']
+    print('instances: {}'.format(instances))
+    print('  scrape latency  p50 {:.3f}s  p90 {:.3f}s  p99 {:.3f}s  max {:.3f}s'.format(
+        percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99), max(latencies)))
+    print('  series/scrape   {}'.format(result['series']))
+    print('  api calls       {:.1f}/scrape, {} throttled'.format(result['calls'] / scrapes, result['throttled']))
+    print('  cpu             {:.3f}s/scrape'.format(result['cpu'] / scrapes))
+    print('  peak rss        {:.1f}MB'.format(result['peak_rss']))
+    print('  inventory load  {} ({} api calls)'.format(
+        '  '.join('{} {}'.format(k, 'failed' if v is None else '{:.3f}s'.format(v))
+                  for k, v in result['inventory'].items()), result['inventory_calls']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape benchmark against a local API stand-in')
+    parser.add_argument('--instances', type=int, nargs='+', default=[10, 1000, 10000], help='ECS fleet sizes')
+    parser.add_argument('--scrapes', type=int, default=5, help='scrapes per fleet size')
+    parser.add_argument('--latency', type=float, default=0.02, help='mean API response latency in seconds')
+    parser.add_argument('--throttle', type=float, default=0.0, help='share of API calls answered with Throttling')
+    parser.add_argument('--metrics', type=int, default=len(ecs_metrics), help='number of ECS metrics to collect')
+    parser.add_argument('--dimensions-from', action='store_true', help='query the ECS metrics by instance id')
+    parser.add_argument('--period-cache', action='store_true', help='enable the period cache')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--rate-limit', type=int, default=1000)
+    parser.add_argument('--verbose', action='store_true', help='show the errors logged by the exporter')
+    args = parser.parse_args()
+
+    for instances in args.instances:
+        report(instances, benchmark(instances, args), args.scrapes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+'''
+Local stand-in for the CloudMonitor, ECS, RDS, Redis, SLB, MongoDB and CDN
+APIs used by the exporter.
+
+Serves a synthetic fleet over plain HTTP, with an optional response latency
+and share of Throttling errors. Every request is counted per API action,
+the counts are served as JSON at /_stats.
+'''
+import json
+import random
+import threading
+import time
+
+from collections import Counter
+from urllib.parse import parse_qs
+
+# (Action, Version) -> product, to tell apart actions shared by several APIs
+products = {
+    ('DescribeInstances', '2014-05-26'): 'ecs',
+    ('DescribeInstances', '2015-01-01'): 'redis',
+    ('DescribeDBInstances', '2014-08-15'): 'rds',
+    ('DescribeDBInstances', '2015-12-01'): 'mongodb',
+}
+
+# CloudMonitor project -> inventory resource whose instances report it
+projects = {
+    'acs_ecs_dashboard': 'ecs',
+    'acs_rds_dashboard': 'rds',
+    'acs_kvstore': 'redis',
+    'acs_slb_dashboard': 'slb',
+    'acs_mongodb': 'mongodb',
+    'acs_cdn': 'cdn',
+}
+
+cms_page_size = 1000
+
+
+'''
+Fleet of 'instances' ECS instances, with one RDS, Redis, SLB and MongoDB
+instance per ten ECS instances and one CDN domain per fifty.
+'''
+class Fleet(object):
+
+    def __init__(self, instances, seed=0):
+        rnd = random.Random(seed)
+        self.resources = {
+            'ecs': ['i-{:012x}'.format(rnd.getrandbits(48)) for _ in range(instances)],
+            'rds': ['rm-{:012x}'.format(rnd.getrandbits(48)) for _ in range(max(1, instances // 10))],
+            'redis': ['r-{:012x}'.format(rnd.getrandbits(48)) for _ in range(max(1, instances // 10))],
+            'slb': ['lb-{:012x}'.format(rnd.getrandbits(48)) for _ in range(max(1, instances // 10))],
+            'mongodb': ['dds-{:012x}'.format(rnd.getrandbits(48)) for _ in range(max(1, instances // 10))],
+            'cdn': ['cdn{}.example.com'.format(i) for i in range(max(1, instances // 50))],
+        }
+
+    def ecs(self, i, instance_id):
+        return {
+            'InstanceId': instance_id,
+            'InstanceName': 'bench-{:05d}'.format(i),
+            'RegionId': 'cn-hangzhou',
+            'ZoneId': 'cn-hangzhou-{}'.format('hijk'[i % 4]),
+            'Status': 'Running',
+            'InstanceType': 'ecs.g6.large',
+            'Cpu': 2,
+            'Memory': 8192,
+            'InnerIpAddress': {'IpAddress': []},
+            'PublicIpAddress': {'IpAddress': []},
+            'VpcAttributes': {'PrivateIpAddress': {'IpAddress': ['172.16.{}.{}'.format(i // 250, i % 250)]}},
+            'ExpiredTime': '2099-12-31T15:59Z',
+        }
+
+    def database(self, i, instance_id):
+        return {
+            'DBInstanceId': instance_id,
+            'DBInstanceDescription': 'bench-{:05d}'.format(i),
+            'RegionId': 'cn-hangzhou',
+            'Engine': 'MySQL',
+            'DBInstanceStatus': 'Running',
+        }
+
+    def redis(self, i, instance_id):
+        return {'InstanceId': instance_id, 'InstanceName': 'bench-{:05d}'.format(i),
+                'RegionId': 'cn-hangzhou', 'InstanceStatus': 'Normal'}
+
+    def slb(self, i, instance_id):
+        return {'LoadBalancerId': instance_id, 'LoadBalancerName': 'bench-{:05d}'.format(i),
+                'RegionId': 'cn-hangzhou', 'LoadBalancerStatus': 'active'}
+
+    def cdn(self, i, domain):
+        return {'DomainName': domain, 'CdnType': 'web', 'DomainStatus': 'online'}
+
+    def page(self, resource, params):
+        size = int(params.get('PageSize', 10))
+        number = int(params.get('PageNumber', 1))
+        build = {'ecs': self.ecs, 'rds': self.database, 'mongodb': self.database,
+                 'redis': self.redis, 'slb': self.slb, 'cdn': self.cdn}[resource]
+        ids = self.resources[resource][(number - 1) * size:number * size]
+        return [build((number - 1) * size + i, instance_id) for i, instance_id in enumerate(ids)]
+
+    def datapoints(self, project, params):
+        resource = projects.get(project, 'ecs')
+        label = 'domain' if resource == 'cdn' else 'instanceId'
+        if params.get('Dimensions'):
+            ids = [d[label] for d in json.loads(params['Dimensions'])]
+        else:
+            ids = self.resources[resource]
+        start = int(params.get('Cursor') or 0)
+        now = int(time.time()) // 60 * 60 * 1000
+        points = [{'timestamp': now, 'userId': '1234567890', label: instance_id,
+                   'Maximum': 90.0, 'Minimum': 10.0, 'Average': 50.0}
+                  for instance_id in ids[start:start + cms_page_size]]
+        cursor = str(start + cms_page_size) if start + cms_page_size < len(ids) else ''
+        return {'Code': '200', 'Period': params.get('Period', '60'),
+                'Datapoints': json.dumps(points), 'Cursor': cursor}
+
+
+'''
+WSGI app answering the RPC style API calls from the fleet.
+'''
+class StandIn(object):
+
+    def __init__(self, fleet: Fleet, latency=0.0, throttle=0.0, seed=0):
+        self.fleet = fleet
+        self.latency = latency
+        self.throttle = throttle
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == '/_stats':
+            with self._lock:
+                body = {'calls': dict(self.calls), 'throttled': dict(self.throttled)}
+            return self.respond(start_response, '200 OK', body)
+        params = {k: v[0] for k, v in parse_qs(environ.get('QUERY_STRING', '')).items()}
+        action = params.get('Action', '')
+        with self._lock:
+            self.calls[action] += 1
+            throttled = self.random.random() < self.throttle
+            if throttled:
+                self.throttled[action] += 1
+        if self.latency:
+            time.sleep(self.random.expovariate(1 / self.latency))
+        if throttled:
+            return self.respond(start_response, '400 Bad Request', {
+                'Code': 'Throttling.User', 'Message': 'Request was denied due to user flow control.'})
+        try:
+            body = self.handle(action, params)
+        except KeyError:
+            return self.respond(start_response, '404 Not Found', {
+                'Code': 'InvalidAction.NotFound', 'Message': 'Unknown action {}'.format(action)})
+        return self.respond(start_response, '200 OK', body)
+
+    def handle(self, action, params):
+        fleet = self.fleet
+        if action == 'QueryMetricLast':
+            return fleet.datapoints(params.get('Project'), params)
+        if action in ('DescribeInstances', 'DescribeDBInstances'):
+            resource = products[(action, params.get('Version'))]
+            items = fleet.page(resource, params)
+            return {
+                'ecs': lambda: {'Instances': {'Instance': items}},
+                'redis': lambda: {'Instances': {'KVStoreInstance': items}},
+                'rds': lambda: {'Items': {'DBInstance': items}},
+                'mongodb': lambda: {'DBInstances': {'DBInstance': items}},
+            }[resource]()
+        if action == 'DescribeLoadBalancers':
+            return {'LoadBalancers': {'LoadBalancer': fleet.page('slb', params)}}
+        if action == 'DescribeLoadBalancerAttribute':
+            return {'ListenerPortsAndProtocol': {'ListenerPortAndProtocol': [
+                {'ListenerProtocol': 'tcp', 'ListenerPort': 80},
+                {'ListenerProtocol': 'https', 'ListenerPort': 443},
+            ]}}
+        if action in ('DescribeLoadBalancerTCPListenerAttribute', 'DescribeLoadBalancerHTTPListenerAttribute',
+                      'DescribeLoadBalancerHTTPSListenerAttribute'):
+            return {'Bandwidth': -1}
+        if action == 'DescribeUserDomains':
+            return {'Domains': {'PageData': fleet.page('cdn', params)}}
+        raise KeyError(action)
+
+    def respond(self, start_response, status, body):
+        start_response(status, [('Content-Type', 'application/json')])
+        return [json.dumps(body).encode('utf-8')]
@@ -33,7 +33,6 @@ setup(
         'aliyun-python-sdk-cms==6.0.13',
         'aliyun-python-sdk-core-v3==2.13.3',
         'pyyaml',
-        'ratelimiter',
         'flask',
         'cachetools',
         'aliyun-python-sdk-ecs==4.16.5',
@@ -42,6 +41,9 @@ setup(
         'aliyun-python-sdk-slb==3.2.8',
         "aliyun-python-sdk-dds==2.0.4",
     ],
+    extras_require={
+        'fast-json': ['orjson'],
+    },
     entry_points={
         'console_scripts': [
             'aliyun-exporter=aliyun_exporter:main',